@@ -0,0 +1,12 @@
+import pytest
+
+
+@pytest.fixture(scope='session', autouse=True)
+def test_settings(django_test_environment):
+    """Тестовые настройки проекта, как у manage.py test."""
+    from core.testing import TestSettings
+
+    overrides = TestSettings()
+    overrides.enable()
+    yield
+    overrides.disable()
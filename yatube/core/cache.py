@@ -0,0 +1,269 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# SQLite не принимает больше 999 параметров в одном запросе.
+MAX_VARIABLES = 999
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY,'
+    ' value BLOB NOT NULL,'
+    ' expires REAL,'
+    ' accessed REAL NOT NULL,'
+    ' size INTEGER NOT NULL'
+    ') WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+)
+
+
+class SQLiteCache(BaseCache):
+    """Кэш в файле SQLite в режиме WAL, общий для всех процессов хоста.
+
+    В отличие от LocMemCache все воркеры gunicorn видят одни и те же
+    записи, и сетевой сервис для этого не нужен. Читатели в WAL не
+    блокируют друг друга и писателя. Размер ограничен MAX_ENTRIES и
+    OPTIONS['MAX_SIZE'] (байты значений): лишнее вытесняется по
+    давности последнего чтения (LRU).
+
+        CACHES = {
+            'default': {
+                'BACKEND': 'core.cache.SQLiteCache',
+                'LOCATION': '/var/tmp/yatube_cache.sqlite3',
+                'OPTIONS': {'MAX_ENTRIES': 100000, 'MAX_SIZE': 256 << 20},
+            }
+        }
+    """
+    # Время последнего чтения обновляется не чаще, чем раз в столько
+    # секунд: иначе каждое чтение превращается в запись.
+    access_resolution = 1.0
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._max_size = options.get('MAX_SIZE')
+        # Проверять размер кэша раз в столько записей.
+        self._cull_interval = options.get('CULL_INTERVAL', 50)
+        self._writes = 0
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        local = self._local
+        # После fork соединение родителя использовать нельзя.
+        if getattr(local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(
+                self._path, timeout=5, isolation_level=None,
+                check_same_thread=False,
+            )
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                db.execute(statement)
+            local.db, local.pid = db, os.getpid()
+        return local.db
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _write(self, statements):
+        """Выполняет пары (sql, params) одной транзакцией."""
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, params in statements:
+                db.execute(sql, params)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _row(self, key, value, timeout, now):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return (key, data, self.get_backend_timeout(timeout), now, len(data))
+
+    def _touch_accessed(self, keys, now):
+        self._db.execute(
+            'UPDATE cache SET accessed = ? WHERE key IN (%s)'
+            % ', '.join('?' * len(keys)),
+            [now, *keys],
+        )
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        names = {self._key(key, version): key for key in keys}
+        now = time.time()
+        found, stale = {}, []
+        db_keys = list(names)
+        for start in range(0, len(db_keys), MAX_VARIABLES):
+            chunk = db_keys[start:start + MAX_VARIABLES]
+            rows = self._db.execute(
+                'SELECT key, value, expires, accessed FROM cache '
+                'WHERE key IN (%s)' % ', '.join('?' * len(chunk)),
+                chunk,
+            )
+            for db_key, data, expires, accessed in rows:
+                if expires is not None and expires <= now:
+                    continue
+                found[names[db_key]] = pickle.loads(data)
+                if now - accessed > self.access_resolution:
+                    stale.append(db_key)
+        for start in range(0, len(stale), MAX_VARIABLES - 1):
+            self._touch_accessed(stale[start:start + MAX_VARIABLES - 1], now)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        now = time.time()
+        self._write(
+            (
+                'INSERT OR REPLACE INTO cache '
+                '(key, value, expires, accessed, size) '
+                'VALUES (?, ?, ?, ?, ?)',
+                self._row(self._key(key, version), value, timeout, now),
+            )
+            for key, value in data.items()
+        )
+        self._written(len(data))
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        db = self._db
+        self._write([
+            ('DELETE FROM cache WHERE key = ? AND expires <= ?', (key, now)),
+            (
+                'INSERT OR IGNORE INTO cache '
+                '(key, value, expires, accessed, size) '
+                'VALUES (?, ?, ?, ?, ?)',
+                self._row(key, value, timeout, now),
+            ),
+        ])
+        added = db.execute('SELECT changes()').fetchone()[0] > 0
+        if added:
+            self._written(1)
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        """Атомарно для всех процессов: чтение и запись в одной транзакции."""
+        db_key = self._key(key, version)
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute(
+                'SELECT value, expires FROM cache WHERE key = ?', (db_key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= time.time()):
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            db.execute(
+                'UPDATE cache SET value = ?, size = ? WHERE key = ?',
+                (data, len(data), db_key),
+            )
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        cursor = self._db.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        row = self._db.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        self._delete([self._key(key, version) for key in keys])
+
+    def _delete(self, db_keys):
+        statements = []
+        for start in range(0, len(db_keys), MAX_VARIABLES):
+            chunk = db_keys[start:start + MAX_VARIABLES]
+            statements.append((
+                'DELETE FROM cache WHERE key IN (%s)'
+                % ', '.join('?' * len(chunk)),
+                chunk,
+            ))
+        self._write(statements)
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Соединение живёт всё время жизни потока: открывать файл
+        # заново на каждый запрос дороже, чем держать его.
+        pass
+
+    def _written(self, count):
+        self._writes += count
+        if self._writes >= self._cull_interval:
+            self._writes = 0
+            self._cull()
+
+    def _cull(self):
+        """Удаляет просроченные записи, затем самые давно читанные."""
+        db = self._db
+        db.execute(
+            'DELETE FROM cache WHERE expires <= ?', (time.time(),)
+        )
+        entries = db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        excess = entries - self._max_entries
+        if excess > 0 and not self._cull_frequency:
+            self.clear()
+            return
+        if excess > 0:
+            # Как и в штатных бэкендах, удаляем с запасом:
+            # 1 / CULL_FREQUENCY записей сверх лимита.
+            excess += entries // self._cull_frequency
+            db.execute(
+                'DELETE FROM cache WHERE key IN ('
+                'SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+                (excess,),
+            )
+        if self._max_size is None:
+            return
+        size = db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM cache'
+        ).fetchone()[0]
+        if size > self._max_size:
+            need, doomed = size - self._max_size, []
+            rows = db.execute('SELECT key, size FROM cache ORDER BY accessed')
+            for key, entry_size in rows:
+                if need <= 0:
+                    break
+                doomed.append(key)
+                need -= entry_size
+            rows.close()
+            self._delete(doomed)
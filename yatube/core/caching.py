@@ -0,0 +1,68 @@
+import math
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+LOCK_KEY = '{}:lock'
+# Как часто запрос без блокировки проверяет, не появилось ли значение.
+POLL_INTERVAL = 0.05
+
+
+def _fresh(entry, beta):
+    """Вероятностное раннее истечение (XFetch).
+
+    Чем дольше считалось значение и чем ближе срок, тем вероятнее,
+    что текущий запрос пересчитает его заранее: запросы не
+    приходят за пересчётом все разом в момент истечения.
+    """
+    value, delta, expires = entry
+    jitter = -delta * beta * math.log(1.0 - random.random())
+    return time.time() + jitter < expires
+
+
+def get_or_compute(key, compute, timeout, grace=None, beta=1.0):
+    """Значение из кэша; при устаревании пересчитывает его один запрос.
+
+    Запись хранится timeout + grace секунд. Когда она устаревает,
+    пересчёт берёт тот запрос, который первым получил блокировку;
+    остальные до конца grace получают прежнее значение. Если
+    значения нет совсем (например, ключ с новой версией после записи),
+    остальные до CACHE_LOCK_WAIT ждут, пока владелец блокировки его
+    посчитает, и только потом считают сами.
+    """
+    if grace is None:
+        grace = settings.CACHE_STALE_GRACE
+    lock = LOCK_KEY.format(key)
+    entry = cache.get(key)
+    if entry is not None and _fresh(entry, beta):
+        return entry[0]
+    # Блокировка хранит метку владельца: снять её может только он.
+    token = uuid.uuid4().hex
+    locked = cache.add(lock, token, settings.CACHE_LOCK_TIMEOUT)
+    if not locked:
+        if entry is None:
+            entry = _wait_for(key)
+        if entry is not None:
+            return entry[0]
+    try:
+        start = time.time()
+        value = compute()
+        delta = time.time() - start
+        cache.set(key, (value, delta, time.time() + timeout), timeout + grace)
+    finally:
+        if locked and cache.get(lock) == token:
+            cache.delete(lock)
+    return value
+
+
+def _wait_for(key):
+    deadline = time.time() + settings.CACHE_LOCK_WAIT
+    while time.time() < deadline:
+        time.sleep(POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return None
@@ -0,0 +1,91 @@
+import html
+import json
+import re
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+# Метка дырки в общей копии страницы. Текст пользователей
+# экранируется, поэтому сам подделать метку он не может.
+HOLE = re.compile(r'<!--hole (?P<name>[\w.-]+) (?P<data>.*?)-->')
+
+_holes = {}
+
+
+def hole(name, template_name):
+    """Регистрирует дырку: функцию (request, **kwargs) -> контекст.
+
+    Дырка - небольшой кусок страницы, который зависит от пользователя
+    (меню входа, кнопка подписки). Он рисуется при каждом запросе,
+    а остальная страница может браться из кэша целиком.
+    """
+    def decorator(func):
+        _holes[name] = (template_name, func)
+        return func
+    return decorator
+
+
+def render_hole(request, name, kwargs):
+    template_name, func = _holes[name]
+    return render_to_string(template_name, func(request, **kwargs), request)
+
+
+def punch(request, name, kwargs):
+    """Метка дырки при сборке общей копии, иначе сам кусок страницы."""
+    if getattr(request, 'punch_holes', False):
+        data = escape(json.dumps(kwargs, sort_keys=True))
+        return mark_safe(f'<!--hole {name} {data}-->')
+    return render_hole(request, name, kwargs)
+
+
+def fill_holes(request, content):
+    def render(match):
+        data = json.loads(html.unescape(match.group('data')))
+        return render_hole(request, match.group('name'), data)
+    return HOLE.sub(render, content)
+
+
+def hole_punched(key_func):
+    """Кэширует страницу одной копией для всех пользователей.
+
+    key_func(request, *args, **kwargs) возвращает ключ общей копии
+    или None, если страницу кэшировать нельзя. В копии вместо дырок
+    стоят метки; при каждом запросе они заменяются кусками, которые
+    нарисованы для текущего пользователя. Режим включается
+    настройкой HOLE_PUNCHED_PAGES.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def inner(request, *args, **kwargs):
+            if (not settings.HOLE_PUNCHED_PAGES
+                    or request.method not in ('GET', 'HEAD')):
+                return view_func(request, *args, **kwargs)
+            key = key_func(request, *args, **kwargs)
+            if key is None:
+                return view_func(request, *args, **kwargs)
+            content = cache.get(key)
+            if content is None:
+                request.punch_holes = True
+                try:
+                    response = view_func(request, *args, **kwargs)
+                finally:
+                    request.punch_holes = False
+                content = response.content.decode(response.charset)
+                if response.status_code == 200:
+                    cache.set(key, content, settings.PAGE_CACHE_TIMEOUT)
+            else:
+                response = HttpResponse()
+            response.content = fill_holes(request, content)
+            return response
+        return inner
+    return decorator
+
+
+@hole('auth_nav', 'includes/auth_nav.html')
+def auth_nav(request):
+    return {}
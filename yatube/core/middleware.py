@@ -0,0 +1,112 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .tasks import running_eager_task
+
+logger = logging.getLogger('core.query_budget')
+
+# Списки параметров IN (%s, %s, ...) разной длины дают один отпечаток.
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+class QueryBudgetExceeded(Exception):
+    """Представление сделало больше запросов, чем ему разрешено."""
+
+
+def query_budget(queries=None, time=None):
+    """Задаёт представлению бюджет: число запросов и время в базе (мс)."""
+    def decorator(view_func):
+        view_func.query_budget = {'queries': queries, 'time': time}
+        return view_func
+    return decorator
+
+
+def fingerprint(sql):
+    """SQL без значений: одинаковые запросы с разными id совпадут."""
+    return IN_LIST.sub('IN (...)', sql)
+
+
+class QueryLog:
+    """Обёртка execute_wrapper: считает запросы и время в базе."""
+
+    def __init__(self):
+        self.sql = []
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        if running_eager_task():
+            return execute(sql, params, many, context)
+        start = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.monotonic() - start
+            self.sql.append(sql)
+
+    @property
+    def time_ms(self):
+        return self.time * 1000
+
+    def duplicates(self):
+        counts = Counter(fingerprint(sql) for sql in self.sql)
+        return [(sql, count) for sql, count in counts.most_common()
+                if count > 1]
+
+
+class QueryBudgetMiddleware:
+    """Сверяет число запросов и время в базе с бюджетом представления.
+
+    Бюджет берётся из settings.QUERY_BUDGETS по имени маршрута
+    ('posts:index') или из декоратора query_budget. Превышение
+    пишется в лог вместе с повторяющимися запросами; при
+    QUERY_BUDGET_RAISE = True бросается QueryBudgetExceeded, и
+    тест, открывший страницу через клиент, падает.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.query_budget = None
+        log = QueryLog()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(log))
+            response = self.get_response(request)
+        if request.query_budget is not None:
+            self.check(request, log)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        budgets = getattr(settings, 'QUERY_BUDGETS', {})
+        budget = budgets.get(request.resolver_match.view_name)
+        if isinstance(budget, int):
+            budget = {'queries': budget, 'time': None}
+        if budget is None:
+            budget = getattr(view_func, 'query_budget', None)
+        request.query_budget = budget
+
+    def check(self, request, log):
+        queries = request.query_budget.get('queries')
+        time_ms = request.query_budget.get('time')
+        over = []
+        if queries is not None and len(log.sql) > queries:
+            over.append(f'запросов {len(log.sql)} > {queries}')
+        if time_ms is not None and log.time_ms > time_ms:
+            over.append(f'время в базе {log.time_ms:.1f} мс > {time_ms}')
+        if not over:
+            return
+        lines = [f'{request.method} {request.path}: ' + ', '.join(over)]
+        lines.extend(
+            f'  {count} x {sql}' for sql, count in log.duplicates()
+        )
+        message = '\n'.join(lines)
+        logger.warning(message)
+        if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+            raise QueryBudgetExceeded(message)
@@ -0,0 +1,58 @@
+import hashlib
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.dispatch import Signal
+
+HASHED_NAME = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+# Отправляется до проверки, есть ли уже файл с тем же хэшем:
+# получатель берёт ссылку на файл, и удаление файлов без ссылок не
+# успеет убрать его между проверкой и сохранением записи.
+content_reserved = Signal(providing_args=['name'])
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Файлы из каталогов CONTENT_ADDRESSED_UPLOADS хранятся по хэшу.
+
+    Имя такого файла - SHA-256 его содержимого: одинаковые загрузки
+    получают одно имя, и второй раз файл не пишется. Остальные файлы
+    (например, миниатюры sorl) сохраняются как обычно.
+    """
+
+    def directory(self, name):
+        """Каталог с хранением по хэшу, в который попадает name, или None."""
+        for directory in settings.CONTENT_ADDRESSED_UPLOADS:
+            if name.startswith(directory):
+                return directory
+        return None
+
+    def is_content_addressed(self, name):
+        directory = self.directory(name)
+        return directory is not None and bool(
+            HASHED_NAME.match(name[len(directory):])
+        )
+
+    def save(self, name, content, max_length=None):
+        directory = self.directory(name)
+        if directory is None or content is None:
+            return super().save(name, content, max_length)
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        name = posixpath.join(directory, digest[:2], digest + extension)
+        content_reserved.send(sender=self.__class__, name=name)
+        if self.exists(name):
+            return name
+        # Если такой же файл успели записать параллельно, получится
+        # копия с суффиксом: лишнее место, но не ошибка.
+        return super().save(name, content, max_length)
@@ -0,0 +1,70 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger('core.tasks')
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+# Поток сейчас выполняет задачу сразу (TASKS_EAGER).
+_eager = threading.local()
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _lock:
+        # Потоки пула не переживают fork воркера: создаём пул заново.
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.TASK_WORKERS,
+                thread_name_prefix='yatube-task',
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _run(func, args, kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception('Фоновая задача %s завершилась ошибкой',
+                         func.__name__)
+    finally:
+        # Соединения с базой у каждого потока свои: закрываем их,
+        # чтобы пул не держал их открытыми между задачами.
+        connections.close_all()
+
+
+def enqueue(func, *args, **kwargs):
+    """Выполняет func в фоновом потоке после коммита транзакции.
+
+    Очередь локальная: задачи живут в памяти процесса и теряются при
+    его остановке, поэтому задача должна быть повторяемой, а её
+    результат - восстановимым без неё. При TASKS_EAGER = True (тесты)
+    func выполняется сразу.
+    """
+    if settings.TASKS_EAGER:
+        _eager.running = True
+        try:
+            func(*args, **kwargs)
+        finally:
+            _eager.running = False
+        return
+    transaction.on_commit(
+        lambda: _get_executor().submit(_run, func, args, kwargs)
+    )
+
+
+def running_eager_task():
+    """Идёт ли в этом потоке задача, выполняемая сразу.
+
+    Без TASKS_EAGER задачи работают в своих потоках и соединениях, и
+    их запросы не входят в бюджет запроса (core.middleware); при
+    TASKS_EAGER их тоже не нужно считать.
+    """
+    return getattr(_eager, 'running', False)
@@ -0,0 +1,17 @@
+from django import template
+
+from core.holes import punch
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def hole(context, name, **kwargs):
+    """Кусок страницы для текущего пользователя.
+
+    {% hole 'follow_button' author=author.username %}
+
+    Аргументы попадают в метку общей копии страницы, поэтому должны
+    сериализоваться в json: id, строки, флаги.
+    """
+    return punch(context.get('request'), name, kwargs)
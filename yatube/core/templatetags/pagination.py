@@ -0,0 +1,27 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag
+def page_window(page_obj, radius=2, edges=1):
+    """Номера страниц для ссылок: окно вокруг текущей и края списка.
+
+    None в списке - место многоточия. Полный page_range не строится,
+    поэтому размер списка не зависит от числа страниц.
+    """
+    current, last = page_obj.number, page_obj.paginator.num_pages
+    numbers = sorted({
+        *range(1, min(edges, last) + 1),
+        *range(max(current - radius, 1), min(current + radius, last) + 1),
+        *range(max(last - edges + 1, 1), last + 1),
+    })
+    window = []
+    for number in numbers:
+        if window and number - window[-1] == 2:
+            # Многоточие вместо одной страницы не короче её номера.
+            window.append(number - 1)
+        elif window and number - window[-1] > 2:
+            window.append(None)
+        window.append(number)
+    return window
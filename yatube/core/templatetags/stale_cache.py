@@ -0,0 +1,48 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+
+from core.caching import get_or_compute
+
+register = template.Library()
+
+
+class StaleCacheNode(template.Node):
+    def __init__(self, nodelist, timeout, fragment_name, vary_on):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        timeout = self.timeout.resolve(context)
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        key = 'stale.' + make_template_fragment_key(
+            self.fragment_name, vary_on
+        )
+        return get_or_compute(
+            key, lambda: self.nodelist.render(context), timeout
+        )
+
+
+@register.tag('stalecache')
+def do_stalecache(parser, token):
+    """Как {% cache %}, но с защитой от одновременного пересчёта.
+
+    {% stalecache 3600 index_page page_key %} ... {% endstalecache %}
+
+    После истечения фрагмент перерисовывает один запрос, остальные
+    получают прежнюю версию (см. core.caching.get_or_compute).
+    """
+    nodelist = parser.parse(('endstalecache',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]} принимает как минимум два аргумента.'
+        )
+    return StaleCacheNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        bits[2],
+        [parser.compile_filter(bit) for bit in bits[3:]],
+    )
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestSettings:
+    """Настройки на время прогона тестов.
+
+    Кэш остаётся SQLiteCache, но в новом временном файле: тестовая
+    база создаётся заново при каждом прогоне, а версии лент живут в
+    кэше, и файл кэша пережил бы прогон. Фоновые задачи выполняются
+    сразу, а превышение бюджета запросов роняет тест. Подключается
+    TestRunner для manage.py test и conftest.py в корне репозитория
+    для pytest.
+    """
+
+    def enable(self):
+        self.directory = tempfile.mkdtemp(prefix='yatube-cache-')
+        default = {
+            'BACKEND': 'core.cache.SQLiteCache',
+            'LOCATION': os.path.join(self.directory, 'cache.sqlite3'),
+            'OPTIONS': settings.CACHES['default'].get('OPTIONS', {}),
+        }
+        self.override = override_settings(
+            CACHES={**settings.CACHES, 'default': default},
+            TASKS_EAGER=True,
+            QUERY_BUDGET_RAISE=True,
+        )
+        self.override.enable()
+
+    def disable(self):
+        self.override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_settings = TestSettings()
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,4 +1,24 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+
+from .cache import SQLiteCache
+from .caching import LOCK_KEY, get_or_compute
+from .middleware import (QueryBudgetExceeded, QueryBudgetMiddleware,
+                         fingerprint)
+from .tasks import _run, enqueue
+from .templatetags.pagination import page_window
+
+User = get_user_model()
 
 
 class ViewTestClass(TestCase):
@@ -6,3 +26,212 @@ class ViewTestClass(TestCase):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, 404)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class QueryBudgetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(
+        QUERY_BUDGETS={'posts:index': 0}, QUERY_BUDGET_RAISE=False
+    )
+    def test_violation_is_logged(self):
+        with self.assertLogs('core.query_budget', 'WARNING') as logs:
+            self.client.get('/')
+        self.assertIn('GET /: запросов', logs.output[0])
+
+    @override_settings(
+        QUERY_BUDGETS={'posts:index': {'queries': 0}},
+        QUERY_BUDGET_RAISE=True,
+    )
+    def test_violation_fails_test(self):
+        with self.assertLogs('core.query_budget', 'WARNING') as logs:
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/')
+        self.assertIn('GET /: запросов', logs.output[0])
+
+    def test_views_fit_their_budgets(self):
+        self.assertEqual(self.client.get('/').status_code, 200)
+
+    def test_eager_tasks_are_not_counted(self):
+        """Запросы задачи, выполненной сразу, не входят в бюджет."""
+        done = []
+
+        def task():
+            list(User.objects.all())
+            list(User.objects.all())
+            done.append(True)
+
+        def view(request):
+            request.query_budget = {'queries': 1}
+            list(User.objects.all())
+            enqueue(task)
+            return HttpResponse()
+
+        with self.assertNoLogs('core.query_budget', 'WARNING'):
+            response = QueryBudgetMiddleware(view)(
+                RequestFactory().get('/')
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(done, [True])
+
+    def test_fingerprint_ignores_in_list_length(self):
+        self.assertEqual(
+            fingerprint('SELECT 1 WHERE id IN (%s, %s, %s)'),
+            fingerprint('SELECT 1 WHERE id IN (%s)'),
+        )
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_cache(self, **options):
+        options.setdefault('CULL_INTERVAL', 1)
+        return SQLiteCache(self.path, {'OPTIONS': options})
+
+    def test_shared_between_instances(self):
+        """Запись одного воркера видна другому."""
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(self.make_cache().get('key'), {'value': 1})
+        self.assertEqual(self.make_cache().incr_version('key'), 2)
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_expiry_add_and_incr(self):
+        self.cache.set('gone', 1, timeout=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get('gone'))
+        self.assertTrue(self.cache.add('gone', 2))
+        self.assertFalse(self.cache.add('gone', 3))
+        self.assertEqual(self.cache.incr('gone', 5), 7)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_get_many_and_delete_many(self):
+        self.cache.set_many({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(self.cache.get_many(['a', 'c', 'x']),
+                         {'a': 1, 'c': 3})
+        self.cache.delete_many(['a', 'b'])
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), {'c': 3})
+
+    def test_least_recently_used_is_evicted(self):
+        cache = self.make_cache(MAX_ENTRIES=2, CULL_FREQUENCY=100)
+        cache.access_resolution = 0
+        cache.set('old', 1)
+        cache.set('used', 2)
+        cache.get('used')
+        cache.set('new', 3)
+        self.assertEqual(cache.get_many(['old', 'used', 'new']),
+                         {'used': 2, 'new': 3})
+
+    def test_size_cap(self):
+        cache = self.make_cache(MAX_SIZE=3000)
+        for number in range(5):
+            cache.set(f'blob{number}', b'x' * 1000)
+        self.assertEqual(
+            sorted(cache.get_many([f'blob{n}' for n in range(5)])),
+            ['blob3', 'blob4'],
+        )
+
+
+class GetOrComputeTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_value_is_computed_once(self):
+        self.assertEqual(get_or_compute('key', self.compute, 60), 1)
+        self.assertEqual(get_or_compute('key', self.compute, 60), 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_while_other_request_recomputes(self):
+        """Пока пересчёт занят другим запросом, отдаётся старое значение."""
+        cache.set('key', ('old', 0, time.time() - 1), 60)
+        cache.add(LOCK_KEY.format('key'), True)
+        self.assertEqual(get_or_compute('key', self.compute, 60), 'old')
+        self.assertEqual(self.calls, 0)
+        cache.delete(LOCK_KEY.format('key'))
+        self.assertEqual(get_or_compute('key', self.compute, 60), 1)
+
+    def test_slow_value_is_recomputed_early(self):
+        """Долгий пересчёт начинается раньше срока истечения."""
+        cache.set('key', ('old', 10 ** 6, time.time() + 1), 60)
+        self.assertEqual(get_or_compute('key', self.compute, 60), 1)
+
+    def test_cold_key_is_computed_once(self):
+        """Одновременные промахи по пустому ключу ждут одного пересчёта."""
+        requests = 5
+        barrier = threading.Barrier(requests)
+        counter = threading.Lock()
+        results = []
+
+        def compute():
+            time.sleep(0.2)
+            with counter:
+                self.calls += 1
+            return 'value'
+
+        def request():
+            barrier.wait()
+            results.append(get_or_compute('cold', compute, 60))
+
+        threads = [threading.Thread(target=request) for _ in range(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['value'] * requests)
+        self.assertEqual(self.calls, 1)
+
+    @override_settings(CACHE_LOCK_WAIT=0.1)
+    def test_request_without_lock_keeps_it(self):
+        """Не дождавшись значения, запрос считает сам, но чужую
+        блокировку не снимает."""
+        cache.add(LOCK_KEY.format('key'), 'holder')
+        self.assertEqual(get_or_compute('key', self.compute, 60), 1)
+        self.assertEqual(cache.get(LOCK_KEY.format('key')), 'holder')
+
+    def test_lock_is_released_by_its_holder(self):
+        cache.set('key', ('old', 0, time.time() - 1), 60)
+        self.assertEqual(get_or_compute('key', self.compute, 60), 1)
+        self.assertIsNone(cache.get(LOCK_KEY.format('key')))
+
+
+class TasksTest(SimpleTestCase):
+    def test_eager_task_runs_at_once(self):
+        done = []
+        with self.settings(TASKS_EAGER=True):
+            enqueue(done.append, 1)
+        self.assertEqual(done, [1])
+
+    def test_failed_task_is_logged(self):
+        def broken():
+            raise ValueError('сломалась')
+        with self.assertLogs('core.tasks', 'ERROR') as logs:
+            _run(broken, (), {})
+        self.assertIn('broken', logs.output[0])
+
+
+class PageWindowTest(SimpleTestCase):
+    def window(self, number, count):
+        return page_window(Paginator(range(count), 1).page(number))
+
+    def test_window_is_bounded(self):
+        self.assertEqual(
+            self.window(25000, 50000),
+            [1, None, 24998, 24999, 25000, 25001, 25002, None, 50000]
+        )
+
+    def test_edges_and_single_gap(self):
+        self.assertEqual(self.window(1, 3), [1, 2, 3])
+        self.assertEqual(self.window(1, 10), [1, 2, 3, None, 10])
+        self.assertEqual(self.window(5, 10), [1, 2, 3, 4, 5, 6, 7, None, 10])
@@ -1,22 +1,70 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.cache import cache
 
+from .feeds import feed_version
 from .models import Group, Post, Follow
+from .search import filter_matching
+from utils.utils import EstimatedCountPaginator
 
+GROUP_CHOICES_KEY = 'admin_group_choices:{}'
 
-class PostAdmin(admin.ModelAdmin):
+
+def group_choices():
+    """Список групп для выпадающих списков из кэша.
+
+    Сбрасывается версией 'groups', которую сдвигает запись группы.
+    """
+    key = GROUP_CHOICES_KEY.format(feed_version('groups'))
+    choices = cache.get(key)
+    if choices is None:
+        choices = list(
+            Group.objects.order_by('title').values_list('pk', 'title')
+        )
+        cache.set(key, choices, settings.FEED_CACHE_TIMEOUT)
+    return choices
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Список без COUNT(*) по всей таблице при каждом открытии."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class PostAdmin(LargeTableAdmin):
     list_display = ('pk', 'text', 'pub_date', 'author', 'group')
+    list_select_related = ('author', 'group')
     search_fields = ('text',)
+    # Фильтр по дате предлагает готовые периоды и не читает таблицу;
+    # date_hierarchy для списка лет строил бы DISTINCT по всем постам.
     list_filter = ('pub_date',)
     list_editable = ('group',)
+    raw_id_fields = ('author',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по полнотекстовому индексу вместо LIKE '%...%'.
+        if not search_term:
+            return queryset, False
+        return filter_matching(queryset, search_term), False
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        field = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if db_field.name == 'group':
+            # Иначе список групп запрашивается для каждой строки.
+            field.choices = [('', field.empty_label)] + group_choices()
+        return field
+
 
-class GroupAdmin(admin.ModelAdmin):
+class GroupAdmin(LargeTableAdmin):
     list_display = ('title', 'description')
+    search_fields = ('title', 'slug')
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(LargeTableAdmin):
     list_display = ('user', 'author')
+    list_select_related = ('user', 'author')
+    raw_id_fields = ('user', 'author')
 
 
 admin.site.register(Post, PostAdmin)
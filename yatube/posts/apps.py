@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        from PIL import Image
+
+        from . import holes, signals  # noqa: F401
+
+        # Защита от «бомб» и там, где картинку открывает не форма:
+        # Pillow откажется декодировать её сам.
+        Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
@@ -0,0 +1,133 @@
+import hashlib
+from functools import wraps
+
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .feeds import feed_position, feed_version
+from .models import Group, Post, User
+
+
+def page_versions(*scopes):
+    return '.'.join(f'{scope}={feed_version(scope)}' for scope in scopes)
+
+
+def page_etag(scopes_func):
+    """etag_func для condition: версии лент страницы и её зритель.
+
+    Версии сдвигаются сигналами при любом изменении постов,
+    комментариев и подписок, поэтому ETag меняется вместе со страницей.
+    """
+    def etag(request, *args, **kwargs):
+        scopes = scopes_func(request, *args, **kwargs)
+        if scopes is None:
+            return None
+        user_id = 0
+        if request.user.is_authenticated:
+            user_id = request.user.pk
+            # Кнопки подписки зависят от подписок зрителя.
+            scopes = [*scopes, f'follow:{user_id}']
+        raw = f'{user_id}|{page_versions(*scopes)}'
+        return hashlib.md5(raw.encode()).hexdigest()
+    return etag
+
+
+def page_key(scopes_func):
+    """key_func для hole_punched: одна копия страницы на всех зрителей.
+
+    Ключ строится из пути и позиции в ленте, а не из полного адреса:
+    лишние параметры (?utm=...) не плодят копии страницы в кэше.
+    """
+    def key(request, *args, **kwargs):
+        scopes = scopes_func(request, *args, **kwargs)
+        if scopes is None:
+            return None
+        raw = (
+            f'{request.path}|{feed_position(request)}|'
+            f'{page_versions(*scopes)}'
+        )
+        return 'page:' + hashlib.md5(raw.encode()).hexdigest()
+    return key
+
+
+def _memoized(request, name, compute):
+    # etag_func и key_func вызываются для одного запроса подряд:
+    # общие для них данные читаются из базы один раз.
+    memo = request.__dict__.setdefault('_conditional', {})
+    if name not in memo:
+        memo[name] = compute()
+    return memo[name]
+
+
+def conditional_page(etag_func):
+    """Ответ 304 без запросов ленты и рендеринга, если страница прежняя.
+
+    Страница сверяется только по ETag: Last-Modified по дате новейшего
+    поста не меняется при правке и удалении постов, подписках и
+    переименовании группы. Страница зависит от пользователя, поэтому
+    ответ помечается private, а no-cache заставляет браузер спрашивать
+    сервер при каждом показе.
+    """
+    def decorator(view_func):
+        conditional_view = condition(etag_func=etag_func)(view_func)
+
+        @wraps(view_func)
+        def inner(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return inner
+    return decorator
+
+
+def index_scopes(request):
+    return ['index']
+
+
+def _group_id(request, slug):
+    group = Group.objects.filter(slug=slug).values_list('pk', flat=True)
+    return _memoized(request, 'group', group.first)
+
+
+def group_scopes(request, slug):
+    group_id = _group_id(request, slug)
+    if group_id is None:
+        return None
+    return [f'group:{group_id}']
+
+
+def _author_id(request, username):
+    author = User.objects.filter(
+        username=username
+    ).values_list('pk', flat=True)
+    return _memoized(request, 'author', author.first)
+
+
+def profile_scopes(request, username):
+    author_id = _author_id(request, username)
+    if author_id is None:
+        return None
+    return [f'author:{author_id}', f'followers:{author_id}',
+            f'follow:{author_id}']
+
+
+def _post(request, post_id):
+    post = Post.objects.filter(pk=post_id).values('author_id', 'group_id')
+    return _memoized(request, 'post', post.first)
+
+
+def post_scopes(request, post_id):
+    post = _post(request, post_id)
+    if post is None:
+        return None
+    scopes = [f'post:{post_id}', f'author:{post["author_id"]}']
+    if post['group_id'] is not None:
+        scopes.append(f'group:{post["group_id"]}')
+    return scopes
+
+
+index_etag, index_page_key = page_etag(index_scopes), page_key(index_scopes)
+group_etag, group_page_key = page_etag(group_scopes), page_key(group_scopes)
+profile_etag = page_etag(profile_scopes)
+profile_page_key = page_key(profile_scopes)
+post_etag, post_page_key = page_etag(post_scopes), page_key(post_scopes)
@@ -0,0 +1,145 @@
+import threading
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Follow, ImageRef, Post, User, UserCounter
+
+USER_COUNTER_FIELDS = ('posts_count', 'followers_count', 'following_count')
+
+# id пользователей, которые сейчас удаляются в этом потоке.
+_deleting = threading.local()
+
+
+def deleting_users():
+    if not hasattr(_deleting, 'ids'):
+        _deleting.ids = set()
+    return _deleting.ids
+
+
+def change_counters(user_id, **deltas):
+    """Атомарно сдвигает счётчики пользователя: posts_count=1 и т.п.
+
+    Уменьшение не опускает счётчик ниже нуля и не создаёт запись
+    счётчиков. Счётчики удаляемого пользователя не трогаются: его
+    запись UserCounter удаляется раньше постов и подписок.
+    """
+    if user_id in deleting_users():
+        return
+    with transaction.atomic():
+        for field, delta in deltas.items():
+            counters = UserCounter.objects.filter(user_id=user_id)
+            update = {field: F(field) + delta}
+            if delta > 0 and not counters.update(**update):
+                UserCounter.objects.get_or_create(user_id=user_id)
+                counters.update(**update)
+            elif delta < 0:
+                counters.filter(
+                    **{f'{field}__gte': -delta}
+                ).update(**update)
+
+
+def change_comments_count(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=F('comments_count') + delta
+    )
+
+
+def change_image_refs(name, delta):
+    """Атомарно сдвигает число ссылок на файл; возвращает новое число.
+
+    Для файла без записи ссылок (не хранимого по хэшу) уменьшение
+    ничего не делает и возвращает None.
+    """
+    with transaction.atomic():
+        refs = ImageRef.objects.filter(name=name)
+        if delta > 0 and not refs.update(refs=F('refs') + delta):
+            ImageRef.objects.get_or_create(name=name)
+            refs.update(refs=F('refs') + delta)
+        elif delta < 0:
+            refs.filter(refs__gte=-delta).update(refs=F('refs') + delta)
+        return refs.values_list('refs', flat=True).first()
+
+
+def counters_for(user):
+    """Счётчики пользователя; нули, если он ещё ничего не делал."""
+    try:
+        return user.counters
+    except UserCounter.DoesNotExist:
+        return UserCounter(user=user)
+
+
+def _totals(queryset, field):
+    return dict(
+        queryset.order_by().values(field).annotate(
+            total=Count('id')
+        ).values_list(field, 'total')
+    )
+
+
+def recount_users():
+    """Пересчитывает счётчики всех пользователей; возвращает число правок."""
+    totals = {
+        'posts_count': _totals(Post.objects, 'author'),
+        'followers_count': _totals(Follow.objects, 'author'),
+        'following_count': _totals(Follow.objects, 'user'),
+    }
+    existing = UserCounter.objects.in_bulk()
+    changed, created = [], []
+    for user_id in User.objects.values_list('id', flat=True).iterator():
+        actual = {
+            field: totals[field].get(user_id, 0)
+            for field in USER_COUNTER_FIELDS
+        }
+        counters = existing.get(user_id)
+        if counters is None:
+            created.append(UserCounter(user_id=user_id, **actual))
+            continue
+        if any(getattr(counters, field) != value
+               for field, value in actual.items()):
+            for field, value in actual.items():
+                setattr(counters, field, value)
+            changed.append(counters)
+    with transaction.atomic():
+        UserCounter.objects.bulk_create(created, batch_size=500)
+        UserCounter.objects.bulk_update(
+            changed, USER_COUNTER_FIELDS, batch_size=500
+        )
+    return len(created) + len(changed)
+
+
+def recount_comments():
+    """Пересчитывает Post.comments_count; возвращает число правок."""
+    comments = Comment.objects.filter(
+        post=OuterRef('pk')
+    ).order_by().values('post').annotate(total=Count('id')).values('total')
+    actual = Coalesce(Subquery(comments), 0)
+    return Post.objects.annotate(actual=actual).exclude(
+        comments_count=F('actual')
+    ).update(comments_count=actual)
+
+
+def recount_images(is_content_addressed):
+    """Пересчитывает ImageRef по постам; возвращает число правок."""
+    actual = {
+        name: total
+        for name, total in _totals(Post.objects.exclude(image=''),
+                                   'image').items()
+        if is_content_addressed(name)
+    }
+    existing = {ref.name: ref for ref in ImageRef.objects.all()}
+    changed = [
+        ref for ref in existing.values()
+        if ref.refs != actual.get(ref.name, 0)
+    ]
+    for ref in changed:
+        ref.refs = actual.get(ref.name, 0)
+    created = [
+        ImageRef(name=name, refs=total)
+        for name, total in actual.items() if name not in existing
+    ]
+    with transaction.atomic():
+        ImageRef.objects.bulk_create(created, batch_size=500)
+        ImageRef.objects.bulk_update(changed, ['refs'], batch_size=500)
+    return len(created) + len(changed)
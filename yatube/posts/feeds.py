@@ -0,0 +1,231 @@
+import hashlib
+import time
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from .models import Comment, Follow, Post, PostTag, Timeline, UserCounter
+from core.caching import get_or_compute
+from utils.utils import (CURSOR_KEYS, create_merged_paginator,
+                         create_paginator, cursor_queryset, encode_cursor)
+
+# Запись Timeline сравнивается с курсором по своей копии даты поста.
+TIMELINE_KEYS = ('pub_date', 'post_id')
+# Связанные объекты, которые шаблоны выводят для каждого поста и
+# комментария: без них каждая строка ленты даёт отдельный запрос.
+POST_RELATED = ('author', 'group')
+TIMELINE_RELATED = tuple(f'post__{name}' for name in POST_RELATED)
+# Ленты выводят анонс, а полный текст поста не читают.
+POST_DEFERRED = ('text', 'text_html')
+TIMELINE_DEFERRED = tuple(f'post__{name}' for name in POST_DEFERRED)
+COMMENT_RELATED = ('author',)
+FEED_VERSION_KEY = 'feed_version:{}'
+# Параметры запроса, которые определяют позицию в ленте.
+FEED_POSITION_PARAMS = ('after', 'before', 'page')
+
+
+def feed_version(scope):
+    """Текущая версия ленты scope: 'index', 'group:<id>' и т.п."""
+    key = FEED_VERSION_KEY.format(scope)
+    version = cache.get(key)
+    if version is None:
+        # Начинаем с текущего времени, а не с единицы: если счётчик
+        # вытеснят из кэша, новая версия не совпадёт со старой.
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_feed_version(*scopes):
+    """Сдвигает версии лент: закэшированные фрагменты больше не читаются."""
+    for scope in scopes:
+        key = FEED_VERSION_KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, int(time.time() * 1000), None)
+
+
+def post_feed_scopes(post_id, author_id, group_id=None):
+    """Ленты и страницы, в которых виден пост."""
+    scopes = {'index', f'author:{author_id}', f'post:{post_id}'}
+    if group_id is not None:
+        scopes.add(f'group:{group_id}')
+    return scopes
+
+
+def feed_position(request):
+    """Позиция в ленте из запроса; прочие параметры в ключи не попадают."""
+    return ':'.join(
+        request.GET.get(param, '') for param in FEED_POSITION_PARAMS
+    )
+
+
+def feed_cache_key(request, *scopes):
+    """Ключ фрагмента ленты: версии scopes и позиция в ленте."""
+    versions = '.'.join(
+        f'{scope}={feed_version(scope)}' for scope in scopes
+    )
+    return f'{versions}:{feed_position(request)}'
+
+
+def cached_feed_page(request, feed_key, build):
+    """Страница ленты из кэша: build() выполняет один запрос из многих.
+
+    Кэшируются только страницы по курсору; старые ссылки ?page=N
+    строятся каждый раз.
+    """
+    if 'page' in request.GET:
+        return build()
+    digest = hashlib.md5(feed_key.encode()).hexdigest()
+    return get_or_compute(
+        f'feed_page:{digest}', build, settings.FEED_CACHE_TIMEOUT
+    )
+
+
+def is_pulled(author_id):
+    """Посты автора читаются при запросе, а не раскладываются по лентам."""
+    return UserCounter.objects.filter(
+        user_id=author_id, feed_pulled=True
+    ).exists()
+
+
+def start_pulling(author_id):
+    """Переводит автора на чтение при запросе; True, если перевёл.
+
+    Переводится автор, у которого подписчиков стало больше
+    FEED_PULL_THRESHOLD.
+    """
+    return bool(UserCounter.objects.filter(
+        user_id=author_id,
+        feed_pulled=False,
+        followers_count__gt=settings.FEED_PULL_THRESHOLD,
+    ).update(feed_pulled=True))
+
+
+def stop_pulling(author_id):
+    """Возвращает автора к раскладке постов; True, если вернул.
+
+    Возвращается автор, у которого подписчиков осталось не больше
+    FEED_PUSH_THRESHOLD. Условный UPDATE срабатывает у одного
+    запроса, поэтому ленты дозаполняет тоже один.
+    """
+    return bool(UserCounter.objects.filter(
+        user_id=author_id,
+        feed_pulled=True,
+        followers_count__lte=settings.FEED_PUSH_THRESHOLD,
+    ).update(feed_pulled=False))
+
+
+def pulled_authors(threshold=None):
+    """Авторы, посты которых подмешиваются при чтении, с их числом.
+
+    С threshold - все авторы, у которых подписчиков больше порога.
+    """
+    if threshold is None:
+        authors = UserCounter.objects.filter(feed_pulled=True)
+    else:
+        authors = UserCounter.objects.filter(followers_count__gt=threshold)
+    return authors.select_related('user').order_by('-followers_count')
+
+
+# Запросы лент строятся функциями ниже: ими пользуются и
+# представления, и проверка индексов audit_indexes.
+def feed_posts(**filters):
+    """Посты для лент: с автором и группой, без полного текста."""
+    return Post.objects.filter(**filters).select_related(
+        *POST_RELATED
+    ).defer(*POST_DEFERRED)
+
+
+def timeline_entries(user_id):
+    """Записи разложенной ленты подписчика вместе с постами."""
+    return Timeline.objects.filter(user_id=user_id).select_related(
+        *TIMELINE_RELATED
+    ).defer(*TIMELINE_DEFERRED)
+
+
+def author_entries(user_id, author_id):
+    """Записи ленты подписчика с постами одного автора."""
+    return Timeline.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    )
+
+
+def tag_entries(tag_id):
+    """Записи ленты хэштега вместе с постами."""
+    return PostTag.objects.filter(tag_id=tag_id).select_related(
+        *TIMELINE_RELATED
+    ).defer(*TIMELINE_DEFERRED)
+
+
+def pulled_follows(user_id):
+    """id авторов из подписок, которых нужно подмешивать при чтении."""
+    return Follow.objects.filter(
+        user_id=user_id, author__counters__feed_pulled=True
+    ).values_list('author_id', flat=True)
+
+
+def follower_ids(author_id):
+    return Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True)
+
+
+def author_post_dates(author_id):
+    """(id, pub_date) постов автора для раскладки по лентам."""
+    return Post.objects.filter(
+        author_id=author_id
+    ).values_list('id', 'pub_date')
+
+
+def comment_slice(post_id, limit, after=None):
+    """До limit комментариев поста от старых к новым после курсора."""
+    comments = Comment.objects.filter(
+        post_id=post_id
+    ).select_related(*COMMENT_RELATED)
+    if after is None:
+        return comments.order_by(*CURSOR_KEYS)[:limit]
+    # before в ленте - это «новее курсора», по возрастанию.
+    return cursor_queryset(comments, CURSOR_KEYS, limit, before=after)
+
+
+def follow_feed(request, count_post_in_page):
+    """Лента подписок: разложенная Timeline плюс посты популярных авторов.
+
+    Обычные авторы читаются из Timeline одним диапазоном по индексу.
+    Авторы с числом подписчиков выше порога (feed_pulled) читаются
+    из Post по (author, pub_date) и сливаются с лентой по pub_date.
+    """
+    timeline = timeline_entries(request.user.pk)
+    pulled = list(pulled_follows(request.user.pk))
+    if not pulled:
+        return create_paginator(
+            request, timeline, count_post_in_page,
+            keys=TIMELINE_KEYS, transform=attrgetter('post')
+        )
+    sources = [(timeline, TIMELINE_KEYS, attrgetter('post'))]
+    sources.extend(
+        (feed_posts(author_id=author_id), CURSOR_KEYS, None)
+        for author_id in pulled
+    )
+    fallback = feed_posts(author__following__user=request.user)
+    return create_merged_paginator(
+        request, sources, fallback, count_post_in_page
+    )
+
+
+def comment_page(post_id, after=None, limit=None):
+    """Комментарии поста от старых к новым после курсора after.
+
+    Возвращает (комментарии, курсор следующей пачки или None).
+    Пачка выбирается диапазоном по индексу (post, pub_date), поэтому
+    дальние пачки стоят столько же, сколько первая.
+    """
+    limit = limit or settings.COUNT_COMMENTS_IN_PAGE
+    rows = list(comment_slice(post_id, limit + 1, after))
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+    return rows, next_cursor
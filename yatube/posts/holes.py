@@ -0,0 +1,35 @@
+from core.holes import hole
+from .forms import CommentForm
+from .models import Follow
+
+
+def _is_author(request, author_id):
+    return request.user.is_authenticated and request.user.pk == author_id
+
+
+@hole('switcher', 'posts/includes/switcher.html')
+def switcher(request, index=None, follow=None):
+    return {'index': index, 'follow': follow}
+
+
+@hole('follow_button', 'posts/includes/follow_button.html')
+def follow_button(request, author):
+    following = request.user.is_authenticated and Follow.objects.filter(
+        user=request.user, author__username=author
+    ).exists()
+    return {'author': author, 'following': following}
+
+
+@hole('post_link', 'posts/includes/post_link.html')
+def post_link(request, post_id, author_id):
+    return {'post_id': post_id, 'is_author': _is_author(request, author_id)}
+
+
+@hole('edit_button', 'posts/includes/edit_button.html')
+def edit_button(request, post_id, author_id):
+    return {'post_id': post_id, 'is_author': _is_author(request, author_id)}
+
+
+@hole('comment_form', 'posts/includes/comment_form.html')
+def comment_form(request, post_id):
+    return {'post_id': post_id, 'form': CommentForm()}
@@ -0,0 +1,129 @@
+import os
+import threading
+from collections import Counter
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from PIL import Image, ImageOps
+from sorl.thumbnail import delete as delete_with_thumbnails
+
+from core.tasks import enqueue
+from .counters import change_image_refs
+from .models import ImageRef
+
+# Тег EXIF с поворотом снимка.
+ORIENTATION = 0x0112
+# Ссылки, взятые при сохранении файла и ещё не отданные посту.
+_reserved = threading.local()
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+
+
+def normalize_upload(upload):
+    """Проверяет загруженную картинку и при необходимости уменьшает её.
+
+    Размер читается из заголовка файла, до декодирования, поэтому
+    «бомба» на миллиарды пикселей отклоняется без расхода памяти.
+    Картинка, у которой сторона больше IMAGE_MAX_SIDE или есть поворот
+    в EXIF, сохраняется уменьшенной копией-мастером в JPEG (PNG при
+    прозрачности): по ней потом рисуются миниатюры. Остальные
+    картинки возвращаются как есть.
+    """
+    max_side = settings.IMAGE_MAX_SIDE
+    upload.seek(0)
+    with Image.open(upload) as image:
+        width, height = image.size
+        if width * height > settings.IMAGE_MAX_PIXELS:
+            raise ValidationError(
+                'Картинка слишком большая: %(width)s×%(height)s пикселей.',
+                code='image_too_large',
+                params={'width': width, 'height': height},
+            )
+        orientation = image.getexif().get(ORIENTATION, 1)
+        if max(width, height) <= max_side and orientation == 1:
+            upload.seek(0)
+            return upload
+        # JPEG декодируется сразу в уменьшенном в 2-8 раз виде.
+        image.draft('RGB', (max_side, max_side))
+        master = ImageOps.exif_transpose(image)
+        master.thumbnail((max_side, max_side), Image.LANCZOS)
+        if has_alpha(master):
+            master = master.convert('RGBA')
+            image_format, extension = 'PNG', '.png'
+            options = {'optimize': True}
+        else:
+            master = master.convert('RGB')
+            image_format, extension = 'JPEG', '.jpg'
+            options = {
+                'quality': settings.IMAGE_MASTER_QUALITY,
+                'optimize': True,
+                'progressive': True,
+            }
+        buffer = BytesIO()
+        master.save(buffer, image_format, **options)
+    name = os.path.splitext(os.path.basename(upload.name))[0] + extension
+    return SimpleUploadedFile(
+        name, buffer.getvalue(), Image.MIME[image_format]
+    )
+
+
+def is_content_addressed(name):
+    """Файл хранится по хэшу содержимого и может быть общим у постов."""
+    check = getattr(default_storage, 'is_content_addressed', None)
+    return bool(name) and check is not None and check(name)
+
+
+def reservations():
+    if not hasattr(_reserved, 'names'):
+        _reserved.names = Counter()
+    return _reserved.names
+
+
+def reserve_image(name):
+    """Берёт ссылку на файл, пока хранилище его сохраняет.
+
+    Ссылку потом получает пост, сохранённый с этим файлом. Если пост
+    так и не сохранился, ссылок остаётся на одну больше: файл не
+    удаляется, пока recount не пересчитает ссылки.
+    """
+    if is_content_addressed(name):
+        change_image_refs(name, 1)
+        reservations()[name] += 1
+
+
+def retain_image(name):
+    if not is_content_addressed(name):
+        return
+    reserved = reservations()
+    if reserved[name]:
+        reserved[name] -= 1
+        if not reserved[name]:
+            del reserved[name]
+        return
+    change_image_refs(name, 1)
+
+
+def release_image(name):
+    """Снимает ссылку поста на файл; файл без ссылок удаляется в фоне."""
+    if is_content_addressed(name) and change_image_refs(name, -1) == 0:
+        enqueue(delete_unused_image, name)
+
+
+def delete_unused_image(name):
+    """Задача очереди: удаляет файл без ссылок вместе с миниатюрами."""
+    with transaction.atomic():
+        # Пока задача ждала, картинку могли загрузить снова.
+        deleted, _ = ImageRef.objects.filter(name=name, refs=0).delete()
+        if deleted:
+            # Файл удаляется до коммита: загрузка той же картинки
+            # ждёт на записи ImageRef и после коммита увидит, что
+            # файла нет, и запишет его заново.
+            delete_with_thumbnails(name)
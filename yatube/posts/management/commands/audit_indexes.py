@@ -0,0 +1,152 @@
+import re
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from posts.feeds import (TIMELINE_KEYS, author_entries, author_post_dates,
+                         comment_slice, feed_posts, follower_ids,
+                         pulled_follows, tag_entries, timeline_entries)
+from posts.models import TagBucket
+from posts.search import SEARCH_TABLE, match_expression, ranked_ids_query
+from posts.tags import trending_totals
+from utils.utils import CURSOR_KEYS, cursor_queryset
+
+# Строки плана SQLite, которые означают проблему с индексами.
+FULL_SCAN = re.compile(r'^SCAN (?!.*\bINDEX\b)')
+TEMP_SORT = re.compile(r'USE TEMP B-TREE')
+# Запросы к этим таблицам сортируют неизбежно: поиск ранжирует все
+# совпадения по bm25, популярные хэштеги - по сумме счётчиков за окно
+# (список кэшируется).
+SORTED_TABLES = (SEARCH_TABLE, TagBucket._meta.db_table)
+
+
+def feed_paths(name, queryset, keys=CURSOR_KEYS):
+    """Первая страница ленты и страницы по курсору в обе стороны."""
+    cursor = (timezone.now(), 1)
+    limit = settings.COUNT_POST_IN_PAGE + 1
+    return {
+        name: cursor_queryset(queryset, keys, limit),
+        f'{name} ?after=': cursor_queryset(
+            queryset, keys, limit, after=cursor
+        ),
+        f'{name} ?before=': cursor_queryset(
+            queryset, keys, limit, before=cursor
+        ),
+    }
+
+
+def access_paths():
+    """Запросы представлений и сигналов posts с условными параметрами.
+
+    Запросы строятся теми же функциями posts.feeds и posts.search,
+    что и в представлениях. Значение - queryset или пара (SQL,
+    параметры).
+    """
+    cursor = (timezone.now(), 1)
+    limit = settings.COUNT_COMMENTS_IN_PAGE + 1
+    match = match_expression('аудит')
+    return {
+        **feed_paths('index', feed_posts()),
+        **feed_paths('group_posts', feed_posts(group_id=1)),
+        **feed_paths('profile', feed_posts(author_id=1)),
+        **feed_paths('tag_posts', tag_entries(1), TIMELINE_KEYS),
+        **feed_paths('follow_index', timeline_entries(1), TIMELINE_KEYS),
+        'follow_index: popular authors': pulled_follows(1),
+        'post_detail: comments': comment_slice(1, limit),
+        'post_comments ?after=': comment_slice(1, limit, cursor),
+        'search': ranked_ids_query(match, limit),
+        'search ?after=': ranked_ids_query(match, limit, (0.0, 1)),
+        'tag_posts: trending': trending_totals(cursor[0]),
+        'post_create: followers': follower_ids(1),
+        'profile_follow: backfill': author_post_dates(1),
+        'profile_unfollow: prune': author_entries(1, 1),
+    }
+
+
+def query_sql(query):
+    if hasattr(query, 'query'):
+        return str(query.query)
+    return query[0]
+
+
+def sort_expected(sql):
+    return any(table in sql for table in SORTED_TABLES)
+
+
+def query_plan(query):
+    """Строки EXPLAIN QUERY PLAN в виде, который отдаёт Django."""
+    if hasattr(query, 'explain'):
+        return query.explain().splitlines()
+    sql, params = query
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [
+            ' '.join(str(column) for column in row)
+            for row in cursor.fetchall()
+        ]
+
+
+def plan_detail(line):
+    # Django отдаёт строку плана как "id parent notused detail".
+    return line.split(' ', 3)[-1]
+
+
+def flagged_lines(plan, allow_sort=False):
+    """Строки плана с полным сканированием или сортировкой."""
+    return [
+        line for line in plan
+        if FULL_SCAN.search(plan_detail(line))
+        or (TEMP_SORT.search(line) and not allow_sort)
+    ]
+
+
+def missing_indexes():
+    """Индексы из Meta.indexes, которых нет в базе: не применена миграция."""
+    with connection.cursor() as cursor:
+        for model in apps.get_app_config('posts').get_models():
+            existing = connection.introspection.get_constraints(
+                cursor, model._meta.db_table
+            )
+            for index in model._meta.indexes:
+                if index.name not in existing:
+                    yield model._meta.label, index.name
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет EXPLAIN QUERY PLAN для запросов лент и отмечает полные '
+        'сканирования таблиц и сортировки во временном B-дереве. '
+        'Ничего не меняет в базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--strict',
+            action='store_true',
+            help='Завершиться с ошибкой, если найдены проблемы.',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Аудит поддерживает только SQLite.')
+        problems = 0
+        for label, name in missing_indexes():
+            problems += 1
+            self.stdout.write(self.style.ERROR(
+                f'{label}: индекс {name} не создан, выполните migrate'
+            ))
+        for name, query in access_paths().items():
+            plan = query_plan(query)
+            flagged = flagged_lines(plan, sort_expected(query_sql(query)))
+            problems += len(flagged)
+            style = self.style.WARNING if flagged else self.style.SUCCESS
+            self.stdout.write(style(name))
+            for line in plan:
+                mark = '!' if line in flagged else ' '
+                self.stdout.write(f'  {mark} {plan_detail(line)}')
+        self.stdout.write(f'Проблем найдено: {problems}')
+        if problems and options['strict']:
+            raise CommandError('Найдены запросы без подходящих индексов.')
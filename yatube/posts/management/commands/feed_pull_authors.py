@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from posts.feeds import pulled_authors
+
+
+class Command(BaseCommand):
+    help = (
+        'Показывает авторов, посты которых подмешиваются в ленты при '
+        'чтении, или всех, у кого подписчиков больше --threshold.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threshold',
+            type=int,
+            help='Порог числа подписчиков.',
+        )
+
+    def handle(self, *args, **options):
+        threshold = options['threshold']
+        authors = pulled_authors(threshold)
+        for counters in authors:
+            self.stdout.write(
+                f'{counters.user.username}\t{counters.followers_count}'
+            )
+        if threshold is None:
+            self.stdout.write(f'Авторов с лентой при чтении: {len(authors)}')
+        else:
+            self.stdout.write(
+                f'Авторов выше порога {threshold}: {len(authors)}'
+            )
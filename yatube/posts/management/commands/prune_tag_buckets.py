@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from posts.tags import prune_tag_buckets
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет часовые счётчики хэштегов старше TRENDING_TAGS_HOURS '
+        'часов: они больше не входят в популярные. Запускается по '
+        'расписанию, например раз в час.'
+    )
+
+    def handle(self, *args, **options):
+        deleted = prune_tag_buckets()
+        self.stdout.write(f'Удалено счётчиков: {deleted}')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет полнотекстовый индекс постов заново: нужен, если '
+        'посты менялись в обход сигналов (update, bulk_create).'
+    )
+
+    def handle(self, *args, **options):
+        total = rebuild_index()
+        self.stdout.write(f'Проиндексировано постов: {total}')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import recount_comments, recount_images, recount_users
+from posts.images import is_content_addressed
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счётчики постов, подписчиков, подписок и '
+        'комментариев и ссылок на файлы картинок, если они разошлись '
+        'с данными.'
+    )
+
+    def handle(self, *args, **options):
+        users = recount_users()
+        posts = recount_comments()
+        images = recount_images(is_content_addressed)
+        self.stdout.write(
+            f'Исправлено счётчиков: пользователей {users}, постов {posts}, '
+            f'картинок {images}'
+        )
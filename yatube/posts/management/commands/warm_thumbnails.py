@@ -0,0 +1,125 @@
+import datetime
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from posts.models import Post
+from posts.thumbnails import warm_image
+
+# Последний обработанный пост: повторный запуск продолжит с него.
+CHECKPOINT_KEY = 'warm_thumbnails:{}:{}'
+
+
+def day_start(date):
+    return timezone.make_aware(
+        datetime.datetime.combine(date, datetime.time())
+    )
+
+
+@contextmanager
+def image_mapper(workers):
+    """map по картинкам: в этом процессе или в пуле из workers процессов."""
+    if workers == 1:
+        yield map
+        return
+    # spawn, а не fork: открытые соединения с базой нельзя делить
+    # между процессами, а новый процесс откроет свои.
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup,
+    ) as executor:
+        yield executor.map
+
+
+class Command(BaseCommand):
+    help = (
+        'Готовит миниатюры картинок постов для всех геометрий шаблонов, '
+        'уже готовые пропускает. Прерванный запуск продолжается с места '
+        'остановки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since', help='Посты, опубликованные с этой даты (ГГГГ-ММ-ДД).'
+        )
+        parser.add_argument(
+            '--until', help='Посты, опубликованные по эту дату включительно.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Число процессов (по умолчанию по числу ядер).',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=200,
+            help='Сколько постов обрабатывать между отметками прогресса.',
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Начать сначала, а не с места прошлой остановки.',
+        )
+
+    def parse_day(self, value):
+        if value is None:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'Неверная дата {value}: нужен ГГГГ-ММ-ДД.')
+        return day
+
+    def handle(self, *args, **options):
+        since = self.parse_day(options['since'])
+        until = self.parse_day(options['until'])
+        if options['workers'] < 1 or options['chunk_size'] < 1:
+            raise CommandError(
+                '--workers и --chunk-size должны быть больше нуля.'
+            )
+        posts = Post.objects.exclude(image='')
+        if since is not None:
+            posts = posts.filter(pub_date__gte=day_start(since))
+        if until is not None:
+            posts = posts.filter(
+                pub_date__lt=day_start(until + datetime.timedelta(days=1))
+            )
+        checkpoint = CHECKPOINT_KEY.format(since or '', until or '')
+        last_id = 0
+        if not options['restart']:
+            last_id = cache.get(checkpoint, 0)
+        total = posts.count()
+        done = posts.filter(pk__lte=last_id).count()
+        if last_id:
+            self.stdout.write(
+                f'Продолжаем после поста {last_id}: {done} из {total} '
+                'уже обработаны'
+            )
+        rendered = existing = failed = 0
+        with image_mapper(options['workers']) as mapper:
+            while True:
+                chunk = list(posts.filter(pk__gt=last_id).order_by(
+                    'pk'
+                ).values_list('pk', 'image')[:options['chunk_size']])
+                if not chunk:
+                    break
+                for result in mapper(warm_image, [name for _, name in chunk]):
+                    rendered += result[0]
+                    existing += result[1]
+                    failed += result[2]
+                last_id = chunk[-1][0]
+                cache.set(checkpoint, last_id, None)
+                done += len(chunk)
+                self.stdout.write(
+                    f'{done}/{total}: нарисовано {rendered}, '
+                    f'уже были {existing}, ошибок {failed}'
+                )
+        cache.delete(checkpoint)
+        self.stdout.write(
+            f'Готово: постов {total}, нарисовано миниатюр {rendered}, '
+            f'уже были {existing}, ошибок {failed}'
+        )
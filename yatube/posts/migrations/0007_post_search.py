@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def fill_search_index(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    schema_editor.execute(
+        'INSERT INTO posts_post_search (rowid, text) '
+        "SELECT id, replace(replace(text, 'ё', 'е'), 'Ё', 'Е') "
+        f'FROM {Post._meta.db_table}'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_image_refs'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE VIRTUAL TABLE posts_post_search USING fts5('
+            "text, tokenize = 'unicode61 remove_diacritics 2')",
+            'DROP TABLE posts_post_search',
+        ),
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
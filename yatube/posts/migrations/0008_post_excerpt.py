@@ -0,0 +1,46 @@
+# Generated by Django 2.2.16 on 2026-10-18 02:12
+
+from django.db import migrations, models
+
+# Копия posts.text.make_excerpt на момент миграции: правки модуля не
+# должны менять уже применённые миграции.
+EXCERPT_LENGTH = 300
+ELLIPSIS = '…'
+
+
+def make_excerpt(text, length=EXCERPT_LENGTH):
+    if len(text) <= length:
+        return text
+    head = text[:length - len(ELLIPSIS)]
+    words = head.rsplit(None, 1)
+    if len(words) == 2 and not text[len(head)].isspace():
+        head = words[0]
+    return head.rstrip() + ELLIPSIS
+
+
+def fill_excerpts(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    posts = []
+    for post in Post.objects.only('id', 'text').iterator():
+        post.excerpt = make_excerpt(post.text)
+        posts.append(post)
+        if len(posts) == 500:
+            Post.objects.bulk_update(posts, ['excerpt'])
+            posts = []
+    Post.objects.bulk_update(posts, ['excerpt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_post_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=300, verbose_name='Анонс'),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 2.2.16 on 2026-10-18 02:13
+
+import re
+from urllib.parse import quote
+
+from django.db import migrations, models
+from django.utils.html import escape, format_html
+
+# Копия posts.text.render_text на момент миграции, без reverse():
+# правки модуля и адресов не должны менять уже применённые миграции.
+# Хэштеги тогда вели на поиск.
+TOKEN = re.compile(
+    r'(?P<url>https?://[^\s<>"\']+)|(?<!\w)#(?P<tag>\w{1,50})'
+)
+URL_TRAILING = '.,:;!?)…'
+
+
+def hashtag_url(tag):
+    return '/search/?q=' + quote('#' + tag)
+
+
+def render_text(text):
+    text = text.replace('\r\n', '\n')
+    parts = []
+    position = 0
+    for match in TOKEN.finditer(text):
+        parts.append(escape(text[position:match.start()]))
+        if match.group('url'):
+            url = match.group('url').rstrip(URL_TRAILING)
+            parts.append(format_html(
+                '<a href="{0}" rel="nofollow noopener">{0}</a>', url
+            ))
+            parts.append(escape(match.group('url')[len(url):]))
+        else:
+            tag = match.group('tag')
+            parts.append(format_html(
+                '<a href="{}">#{}</a>', hashtag_url(tag), tag
+            ))
+        position = match.end()
+    parts.append(escape(text[position:]))
+    return ''.join(parts).replace('\n', '<br>\n')
+
+
+def render_all(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    for model, fields in (
+        (Post, ('text', 'excerpt')),
+        (Comment, ('text',)),
+    ):
+        rows = []
+        for row in model.objects.only('id', *fields).iterator():
+            for field in fields:
+                setattr(row, f'{field}_html', render_text(getattr(row, field)))
+            rows.append(row)
+            if len(rows) == 500:
+                model.objects.bulk_update(
+                    rows, [f'{field}_html' for field in fields]
+                )
+                rows = []
+        model.objects.bulk_update(rows, [f'{field}_html' for field in fields])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_post_excerpt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='text_html',
+            field=models.TextField(blank=True, editable=False, verbose_name='HTML текста'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpt_html',
+            field=models.TextField(blank=True, editable=False, verbose_name='HTML анонса'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='text_html',
+            field=models.TextField(blank=True, editable=False, verbose_name='HTML текста'),
+        ),
+        migrations.RunPython(render_all, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,186 @@
+# Generated by Django 2.2.16 on 2026-10-18 02:15
+
+import re
+from urllib.parse import quote
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from django.utils.html import escape, format_html
+
+BATCH_SIZE = 500
+
+# Копии posts.text.render_text и extract_hashtags на момент
+# миграции, без reverse(): правки модуля и адресов не должны менять
+# уже применённые миграции. Хэштеги ведут на ленту тега.
+TAG_LENGTH = 50
+TOKEN = re.compile(
+    r'(?P<url>https?://[^\s<>"\']+)|(?<!\w)#(?P<tag>\w{1,50})'
+)
+URL_TRAILING = '.,:;!?)…'
+
+
+def hashtag_url(tag):
+    return '/tag/' + quote(tag.lower()) + '/'
+
+
+def render_text(text):
+    text = text.replace('\r\n', '\n')
+    parts = []
+    position = 0
+    for match in TOKEN.finditer(text):
+        parts.append(escape(text[position:match.start()]))
+        if match.group('url'):
+            url = match.group('url').rstrip(URL_TRAILING)
+            parts.append(format_html(
+                '<a href="{0}" rel="nofollow noopener">{0}</a>', url
+            ))
+            parts.append(escape(match.group('url')[len(url):]))
+        else:
+            tag = match.group('tag')
+            parts.append(format_html(
+                '<a href="{}">#{}</a>', hashtag_url(tag), tag
+            ))
+        position = match.end()
+    parts.append(escape(text[position:]))
+    return ''.join(parts).replace('\n', '<br>\n')
+
+
+def extract_hashtags(text):
+    return {
+        match.group('tag').lower()[:TAG_LENGTH]
+        for match in TOKEN.finditer(text) if match.group('tag')
+    }
+
+
+def batches(queryset):
+    batch = []
+    for row in queryset.iterator(chunk_size=BATCH_SIZE):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def tag_posts(apps, posts):
+    """Рисует HTML пачки постов и раскладывает их по хэштегам."""
+    Post = apps.get_model('posts', 'Post')
+    Tag = apps.get_model('posts', 'Tag')
+    PostTag = apps.get_model('posts', 'PostTag')
+    post_tags = []
+    for post in posts:
+        post.text_html = render_text(post.text)
+        post.excerpt_html = render_text(post.excerpt)
+        post_tags.extend(
+            (name, post.pk, post.pub_date)
+            for name in extract_hashtags(post.text)
+        )
+    Post.objects.bulk_update(posts, ['text_html', 'excerpt_html'])
+    names = {name for name, _, _ in post_tags}
+    Tag.objects.bulk_create(
+        [Tag(name=name) for name in names], ignore_conflicts=True
+    )
+    tag_ids = dict(Tag.objects.filter(
+        name__in=names
+    ).values_list('name', 'id'))
+    PostTag.objects.bulk_create(
+        [
+            PostTag(tag_id=tag_ids[name], post_id=post_id, pub_date=pub_date)
+            for name, post_id, pub_date in post_tags
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def fill_tags(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    PostTag = apps.get_model('posts', 'PostTag')
+    TagBucket = apps.get_model('posts', 'TagBucket')
+    # Хэштеги теперь ведут на ленту тега: HTML рисуется заново.
+    for posts in batches(Post.objects.only(
+        'id', 'text', 'excerpt', 'pub_date'
+    )):
+        tag_posts(apps, posts)
+    for comments in batches(Comment.objects.only('id', 'text')):
+        for comment in comments:
+            comment.text_html = render_text(comment.text)
+        Comment.objects.bulk_update(comments, ['text_html'])
+    # Часовые счётчики считает база по уже разложенным хэштегам.
+    buckets = PostTag.objects.annotate(
+        hour=Trunc('pub_date', 'hour', tzinfo=timezone.utc)
+    ).values('tag_id', 'hour').annotate(total=Count('id')).order_by()
+    for rows in batches(buckets):
+        TagBucket.objects.bulk_create([
+            TagBucket(tag_id=row['tag_id'], hour=row['hour'],
+                      count=row['total'])
+            for row in rows
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_rendered_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Название')),
+            ],
+            options={
+                'verbose_name': 'Хэштег',
+                'verbose_name_plural': 'Хэштеги',
+            },
+        ),
+        migrations.CreateModel(
+            name='TagBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='Час')),
+                ('count', models.IntegerField(default=0, verbose_name='Постов')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='posts.Tag', verbose_name='Хэштег')),
+            ],
+            options={
+                'verbose_name': 'Счётчик хэштега за час',
+                'verbose_name_plural': 'Счётчики хэштегов по часам',
+            },
+        ),
+        migrations.CreateModel(
+            name='PostTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='posts.Post', verbose_name='Пост')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='posts.Tag', verbose_name='Хэштег')),
+            ],
+            options={
+                'verbose_name': 'Хэштег поста',
+                'verbose_name_plural': 'Хэштеги постов',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tagbucket',
+            index=models.Index(fields=['hour', 'tag'], name='tagbucket_hour_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='tagbucket',
+            constraint=models.UniqueConstraint(fields=('tag', 'hour'), name='unique_tag_hour'),
+        ),
+        migrations.AddIndex(
+            model_name='posttag',
+            index=models.Index(fields=['tag', '-pub_date', '-post'], name='posttag_tag_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='posttag',
+            constraint=models.UniqueConstraint(fields=('post', 'tag'), name='unique_post_tag'),
+        ),
+        migrations.RunPython(fill_tags, migrations.RunPython.noop),
+    ]
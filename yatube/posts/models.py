@@ -2,6 +2,7 @@ from django.contrib.auth import get_user_model
 from django.db import models
 
 from core.models import CreatedModel
+from .text import ELLIPSIS, EXCERPT_LENGTH, make_excerpt, render_text
 
 
 User = get_user_model()
@@ -32,15 +33,59 @@ class Post(CreatedModel):
         upload_to='posts/',
         blank=True,
     )
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев',
+        default=0,
+        editable=False,
+    )
+    # Начало текста для лент: им не нужно читать весь text.
+    excerpt = models.CharField(
+        'Анонс',
+        max_length=EXCERPT_LENGTH,
+        blank=True,
+        editable=False,
+    )
+    # Готовый HTML текста и анонса (posts.text.render_text).
+    text_html = models.TextField('HTML текста', blank=True, editable=False)
+    excerpt_html = models.TextField(
+        'HTML анонса', blank=True, editable=False
+    )
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date_idx'
+            ),
+        ]
 
     def __str__(self) -> str:
         return self.text[:15]
 
+    def save(self, *args, **kwargs):
+        if 'text' not in self.get_deferred_fields():
+            self.excerpt = make_excerpt(self.text)
+            self.text_html = render_text(self.text)
+            self.excerpt_html = render_text(self.excerpt)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'text' in update_fields:
+                kwargs['update_fields'] = {
+                    *update_fields, 'excerpt', 'text_html', 'excerpt_html'
+                }
+        super().save(*args, **kwargs)
+
+    @property
+    def excerpt_truncated(self):
+        """Анонс обрезан: ленте нужна ссылка «читать дальше»."""
+        return self.excerpt.endswith(ELLIPSIS)
+
 
 class Group(models.Model):
     title = models.CharField(max_length=200, verbose_name='Заголовок')
@@ -68,10 +113,25 @@ class Comment(CreatedModel):
         verbose_name='Комментарий',
         help_text='Введите текст комментария'
     )
+    text_html = models.TextField('HTML текста', blank=True, editable=False)
+
+    class Meta:
+        indexes = [models.Index(
+            fields=['post', 'pub_date'],
+            name='comment_post_pub_date_idx'
+        )
+        ]
 
     def __str__(self):
         return self.post
 
+    def save(self, *args, **kwargs):
+        self.text_html = render_text(self.text)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'text' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'text_html'}
+        super().save(*args, **kwargs)
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
@@ -93,3 +153,145 @@ class Follow(models.Model):
             name='unique_follow'
         )
         ]
+        # Обратный путь: подписчики автора.
+        indexes = [models.Index(
+            fields=['author', 'user'],
+            name='follow_author_user_idx'
+        )
+        ]
+
+
+class Timeline(models.Model):
+    """Лента подписок: посты, разложенные подписчикам при публикации."""
+    user = models.ForeignKey(
+        User,
+        related_name='timeline',
+        verbose_name='Подписчик',
+        on_delete=models.CASCADE
+    )
+    post = models.ForeignKey(
+        Post,
+        related_name='timeline',
+        verbose_name='Пост',
+        on_delete=models.CASCADE
+    )
+    # Копия Post.pub_date: лента читается одним диапазоном по индексу.
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        indexes = [models.Index(
+            fields=['user', '-pub_date', '-post'],
+            name='timeline_user_pub_date_idx'
+        )
+        ]
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'post'],
+            name='unique_timeline_post'
+        )
+        ]
+
+
+class UserCounter(models.Model):
+    """Счётчики пользователя, поддерживаемые при записи."""
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        related_name='counters',
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE
+    )
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+    # Посты автора подмешиваются в ленты при чтении (posts.feeds).
+    feed_pulled = models.BooleanField('Лента при чтении', default=False)
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+
+class ImageRef(models.Model):
+    """Сколько постов ссылается на файл картинки, хранимый по хэшу."""
+    name = models.CharField('Файл', max_length=100, unique=True)
+    refs = models.PositiveIntegerField('Ссылок', default=0)
+
+    class Meta:
+        verbose_name = 'Файл картинки'
+        verbose_name_plural = 'Файлы картинок'
+
+
+class Tag(models.Model):
+    """Хэштег из текста постов; имя в нижнем регистре."""
+    name = models.CharField('Название', max_length=50, unique=True)
+
+    class Meta:
+        verbose_name = 'Хэштег'
+        verbose_name_plural = 'Хэштеги'
+
+    def __str__(self):
+        return self.name
+
+
+class PostTag(models.Model):
+    """Обратный индекс хэштегов: посты тега по дате, как Timeline."""
+    tag = models.ForeignKey(
+        Tag,
+        related_name='post_tags',
+        verbose_name='Хэштег',
+        on_delete=models.CASCADE
+    )
+    post = models.ForeignKey(
+        Post,
+        related_name='post_tags',
+        verbose_name='Пост',
+        on_delete=models.CASCADE
+    )
+    # Копия Post.pub_date: лента тега читается диапазоном по индексу.
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'Хэштег поста'
+        verbose_name_plural = 'Хэштеги постов'
+        indexes = [models.Index(
+            fields=['tag', '-pub_date', '-post'],
+            name='posttag_tag_pub_date_idx'
+        )
+        ]
+        constraints = [models.UniqueConstraint(
+            fields=['post', 'tag'],
+            name='unique_post_tag'
+        )
+        ]
+
+
+class TagBucket(models.Model):
+    """Число постов с хэштегом, опубликованных за один час.
+
+    Популярные хэштеги считаются суммой последних часов, без
+    просмотра самих постов.
+    """
+    tag = models.ForeignKey(
+        Tag,
+        related_name='buckets',
+        verbose_name='Хэштег',
+        on_delete=models.CASCADE
+    )
+    hour = models.DateTimeField('Час')
+    count = models.IntegerField('Постов', default=0)
+
+    class Meta:
+        verbose_name = 'Счётчик хэштега за час'
+        verbose_name_plural = 'Счётчики хэштегов по часам'
+        indexes = [models.Index(
+            fields=['hour', 'tag'],
+            name='tagbucket_hour_idx'
+        )
+        ]
+        constraints = [models.UniqueConstraint(
+            fields=['tag', 'hour'],
+            name='unique_tag_hour'
+        )
+        ]
@@ -0,0 +1,167 @@
+import re
+
+from django.core.paginator import Page, Paginator
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+
+from .feeds import feed_posts
+from .models import Post
+from utils.utils import decode_token, encode_token
+
+# Полнотекстовый индекс SQLite FTS5 по тексту постов (миграция
+# 0007_post_search); rowid - id поста. Таблица хранит свою копию
+# текста, поэтому для удаления записи старый текст не нужен.
+SEARCH_TABLE = 'posts_post_search'
+# unicode61 не считает «ё» буквой «е» с диакритикой: приводим сами
+# и в тексте, и в запросе.
+INDEXED_TEXT = "replace(replace(text, 'ё', 'е'), 'Ё', 'Е')"
+# Больше слов в запросе не учитывается.
+MAX_TERMS = 10
+TERM = re.compile(r'\w+')
+
+
+def normalize(text):
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def index_post(post_id, text):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [post_id]
+        )
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, text) VALUES (%s, %s)',
+            [post_id, normalize(text)],
+        )
+
+
+def unindex_post(post_id):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [post_id]
+        )
+
+
+def rebuild_index():
+    """Заполняет индекс заново по всем постам; возвращает их число."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, text) '
+            f'SELECT id, {INDEXED_TEXT} FROM {Post._meta.db_table}'
+        )
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) "
+            "VALUES ('optimize')"
+        )
+        cursor.execute(f'SELECT count(*) FROM {SEARCH_TABLE}')
+        return cursor.fetchone()[0]
+
+
+def match_expression(query):
+    """Запрос FTS5 из слов пользователя или None, если слов нет.
+
+    Каждое слово берётся в кавычки, поэтому операторы FTS5 в тексте
+    запроса не работают; все слова обязательны и ищутся по префиксу.
+    """
+    terms = TERM.findall(normalize(query))[:MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def encode_rank_cursor(rank, pk):
+    return encode_token(repr(rank), pk)
+
+
+def decode_rank_cursor(token):
+    """Возвращает (rank, id) из токена или None, если токен битый."""
+    parts = decode_token(token)
+    if parts is None:
+        return None
+    try:
+        return float(parts[0]), int(parts[1])
+    except ValueError:
+        return None
+
+
+def ranked_ids_query(match, limit, after=None):
+    """SQL и параметры запроса ranked_ids."""
+    sql = (
+        f'SELECT rowid, bm25({SEARCH_TABLE}) FROM {SEARCH_TABLE} '
+        f'WHERE {SEARCH_TABLE} MATCH %s'
+    )
+    params = [match]
+    if after is not None:
+        sql += (
+            f' AND (bm25({SEARCH_TABLE}) > %s'
+            f' OR (bm25({SEARCH_TABLE}) = %s AND rowid > %s))'
+        )
+        params += [after[0], after[0], after[1]]
+    sql += f' ORDER BY bm25({SEARCH_TABLE}), rowid LIMIT %s'
+    params.append(limit)
+    return sql, params
+
+
+def ranked_ids(match, limit, after=None):
+    """До limit пар (id, rank) лучших совпадений после курсора.
+
+    bm25 тем меньше, чем выше релевантность, поэтому сортировка по
+    возрастанию; id разбирает посты с одинаковым рангом.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(*ranked_ids_query(match, limit, after))
+        return cursor.fetchall()
+
+
+class SearchPaginator(Paginator):
+    """Курсорная пагинация результатов поиска по (ранг, id).
+
+    Как и у CursorPaginator, общее число страниц неизвестно: номер
+    страницы условный.
+    """
+
+    def __init__(self, match, per_page):
+        super().__init__(None, per_page)
+        self.match = match
+
+    def _check_object_list_is_ordered(self):
+        pass
+
+    def cursor_page(self, after=None):
+        rows = ranked_ids(self.match, self.per_page + 1, after)
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        posts = feed_posts().in_bulk([pk for pk, _ in rows])
+        items = [posts[pk] for pk, _ in rows if pk in posts]
+        number = 2 if after is not None else 1
+        self.num_pages = number + 1 if has_next else number
+        page = Page(items, number, self)
+        page.is_cursor = True
+        page.previous_cursor = page.next_cursor = None
+        if has_next:
+            page.next_cursor = encode_rank_cursor(rows[-1][1], rows[-1][0])
+        return page
+
+
+class RawSubquery(RawSQL):
+    """Подзапрос на чистом SQL для условия __in.
+
+    Условие само берёт правую часть в скобки, а RawSQL добавил бы
+    вторые: IN ((SELECT ...)) SQLite считает списком из одного
+    скалярного подзапроса и берёт только первую строку.
+    """
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def filter_matching(queryset, query):
+    """queryset постов, суженный до подходящих под запрос."""
+    match = match_expression(query)
+    if match is None:
+        return queryset.none()
+    return queryset.filter(pk__in=RawSubquery(
+        f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s',
+        [match],
+    ))
@@ -0,0 +1,226 @@
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from core.storage import content_reserved
+from core.tasks import enqueue
+from .counters import (change_comments_count, change_counters,
+                       deleting_users)
+from .feeds import (author_entries, author_post_dates, bump_feed_version,
+                    follower_ids, is_pulled, post_feed_scopes,
+                    start_pulling, stop_pulling)
+from .images import release_image, reserve_image, retain_image
+from .models import Comment, Follow, Group, Post, Timeline, User
+from .search import index_post, unindex_post
+from .tags import change_tag_counts, post_tag_ids, sync_post_tags
+
+# Сколько записей ленты вставлять за один запрос.
+TIMELINE_BATCH_SIZE = 500
+
+
+@receiver(pre_delete, sender=User)
+def remember_deleting_user(sender, instance, **kwargs):
+    """Посты и подписки удаляемого пользователя уходят каскадом.
+
+    Его собственные счётчики при этом не пересчитываются.
+    """
+    deleting_users().add(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_user(sender, instance, **kwargs):
+    deleting_users().discard(instance.pk)
+
+
+# Счётчики подключаются первыми: обработчики ленты ниже читают
+# уже обновлённое число подписчиков.
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, **kwargs):
+    if created:
+        change_counters(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    change_counters(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, **kwargs):
+    if created:
+        change_comments_count(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    change_comments_count(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Post)
+def count_image_refs(sender, instance, **kwargs):
+    old_image = getattr(instance, '_old_image', '')
+    if instance.image.name != old_image:
+        retain_image(instance.image.name)
+        release_image(old_image)
+
+
+@receiver(content_reserved)
+def reserve_stored_image(sender, name, **kwargs):
+    reserve_image(name)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_image(sender, instance, **kwargs):
+    release_image(instance.image.name)
+
+
+@receiver(post_save, sender=Post)
+def index_post_text(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'text' in update_fields:
+        index_post(instance.pk, instance.text)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, **kwargs):
+    unindex_post(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def index_post_tags(sender, instance, update_fields=None, **kwargs):
+    """Разбирает хэштеги поста и сбрасывает ленты его хэштегов."""
+    if update_fields is None or 'text' in update_fields:
+        tag_ids = sync_post_tags(instance)
+    else:
+        tag_ids = post_tag_ids(instance.pk)
+    bump_feed_version(*(f'tag:{tag_id}' for tag_id in tag_ids))
+
+
+@receiver(pre_delete, sender=Post)
+def unindex_post_tags(sender, instance, **kwargs):
+    # Записи PostTag удалятся каскадом, счётчики нужно снять до этого.
+    tag_ids = post_tag_ids(instance.pk)
+    change_tag_counts(tag_ids, instance.pub_date, -1)
+    bump_feed_version(*(f'tag:{tag_id}' for tag_id in tag_ids))
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, **kwargs):
+    if created:
+        change_counters(instance.author_id, followers_count=1)
+        change_counters(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    change_counters(instance.author_id, followers_count=-1)
+    change_counters(instance.user_id, following_count=-1)
+
+
+def fill_timeline(user_id, author_id):
+    """Раскладывает все посты автора в ленту подписчика."""
+    posts = author_post_dates(author_id)
+    Timeline.objects.bulk_create(
+        (
+            Timeline(user_id=user_id, post_id=post_id, pub_date=pub_date)
+            for post_id, pub_date in posts.iterator()
+        ),
+        batch_size=TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+@receiver(post_save, sender=Post)
+def push_post_to_followers(sender, instance, created, **kwargs):
+    """Раскладывает новый пост в ленты подписчиков автора."""
+    if not created or is_pulled(instance.author_id):
+        return
+    followers = follower_ids(instance.author_id)
+    Timeline.objects.bulk_create(
+        (
+            Timeline(user_id=user_id, post=instance,
+                     pub_date=instance.pub_date)
+            for user_id in followers.iterator()
+        ),
+        batch_size=TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def refill_timelines(author_id):
+    """Задача очереди: дозаполняет ленты подписчиков постами автора."""
+    for user_id in follower_ids(author_id).iterator():
+        fill_timeline(user_id, author_id)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    """Добавляет в ленту подписчика уже опубликованные посты автора."""
+    if not created:
+        return
+    start_pulling(instance.author_id)
+    if not is_pulled(instance.author_id):
+        fill_timeline(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance, **kwargs):
+    """Убирает из ленты посты автора, от которого отписались."""
+    author_entries(instance.user_id, instance.author_id).delete()
+    if stop_pulling(instance.author_id):
+        # Новые посты автора уже раскладываются при публикации, а
+        # прежние подписчикам дозаполнит фоновая задача: до неё в
+        # ленте не будет только старых постов.
+        enqueue(refill_timelines, instance.author_id)
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_state(sender, instance, **kwargs):
+    """Запоминает прежние группу и картинку поста.
+
+    Ленту прежней группы нужно сбросить, а со старой картинки - снять
+    ссылку.
+    """
+    instance._old_group_id, instance._old_image = None, ''
+    if instance.pk is not None:
+        old = Post.objects.filter(pk=instance.pk).values_list(
+            'group_id', 'image'
+        ).first()
+        if old is not None:
+            instance._old_group_id, instance._old_image = old
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def bump_post_feeds(sender, instance, **kwargs):
+    """Сбрасывает кэш лент, в которых виден пост, и его страницы."""
+    scopes = post_feed_scopes(
+        instance.pk, instance.author_id, instance.group_id
+    )
+    old_group_id = getattr(instance, '_old_group_id', None)
+    if old_group_id is not None:
+        scopes.add(f'group:{old_group_id}')
+    bump_feed_version(*scopes)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def bump_group_feeds(sender, instance, **kwargs):
+    """Название группы выводится в общей ленте: сбрасываем и её.
+
+    Версия 'groups' сбрасывает список групп в админке.
+    """
+    bump_feed_version('index', f'group:{instance.pk}', 'groups')
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def bump_follow_feed(sender, instance, **kwargs):
+    bump_feed_version(
+        f'follow:{instance.user_id}', f'followers:{instance.author_id}'
+    )
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_comment_page(sender, instance, **kwargs):
+    bump_feed_version(f'post:{instance.post_id}')
@@ -0,0 +1,110 @@
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from core.caching import get_or_compute
+from .models import PostTag, Tag, TagBucket
+from .text import extract_hashtags
+
+TRENDING_KEY = 'trending_tags'
+
+
+def bucket_hour(date):
+    return date.replace(minute=0, second=0, microsecond=0)
+
+
+def change_tag_counts(tag_ids, pub_date, delta):
+    """Сдвигает счётчики хэштегов за час публикации поста."""
+    if not tag_ids:
+        return
+    hour = bucket_hour(pub_date)
+    with transaction.atomic():
+        if delta > 0:
+            TagBucket.objects.bulk_create(
+                [TagBucket(tag_id=tag_id, hour=hour) for tag_id in tag_ids],
+                ignore_conflicts=True,
+            )
+        TagBucket.objects.filter(tag_id__in=tag_ids, hour=hour).update(
+            count=F('count') + delta
+        )
+
+
+def post_tag_ids(post_id):
+    return list(PostTag.objects.filter(
+        post_id=post_id
+    ).values_list('tag_id', flat=True))
+
+
+def sync_post_tags(post):
+    """Приводит хэштеги поста к тексту; возвращает id старых и новых.
+
+    Счётчики трогаются только у добавленных и снятых хэштегов.
+    """
+    names = extract_hashtags(post.text)
+    current = dict(PostTag.objects.filter(post=post).values_list(
+        'tag__name', 'tag_id'
+    ))
+    removed = [current[name] for name in current.keys() - names]
+    added = names - current.keys()
+    if removed:
+        PostTag.objects.filter(post=post, tag_id__in=removed).delete()
+        change_tag_counts(removed, post.pub_date, -1)
+    added_ids = []
+    if added:
+        Tag.objects.bulk_create(
+            [Tag(name=name) for name in added], ignore_conflicts=True
+        )
+        added_ids = list(Tag.objects.filter(
+            name__in=added
+        ).values_list('id', flat=True))
+        PostTag.objects.bulk_create(
+            [
+                PostTag(tag_id=tag_id, post=post, pub_date=post.pub_date)
+                for tag_id in added_ids
+            ],
+            ignore_conflicts=True,
+        )
+        change_tag_counts(added_ids, post.pub_date, 1)
+    return set(current.values()) | set(added_ids)
+
+
+def trending_totals(since):
+    """Пары (имя, число постов) по счётчикам начиная с часа since."""
+    return TagBucket.objects.filter(hour__gte=since).values(
+        'tag__name'
+    ).annotate(total=Sum('count')).filter(total__gt=0).order_by(
+        '-total', 'tag__name'
+    ).values_list('tag__name', 'total')[:settings.TRENDING_TAGS_COUNT]
+
+
+def trending_since():
+    """Первый час окна популярных хэштегов."""
+    return bucket_hour(timezone.now()) - datetime.timedelta(
+        hours=settings.TRENDING_TAGS_HOURS - 1
+    )
+
+
+def prune_tag_buckets():
+    """Удаляет счётчики до окна популярных хэштегов; возвращает их число.
+
+    Вызывается командой prune_tag_buckets, а не при показе страниц:
+    чтение ленты не должно писать в базу.
+    """
+    deleted, _ = TagBucket.objects.filter(hour__lt=trending_since()).delete()
+    return deleted
+
+
+def trending_tags():
+    """Популярные хэштеги последних TRENDING_TAGS_HOURS часов.
+
+    Список пар (имя, число постов) считается по часовым счётчикам и
+    кэшируется на TRENDING_TAGS_TIMEOUT секунд.
+    """
+    def compute():
+        return list(trending_totals(trending_since()))
+    return get_or_compute(
+        TRENDING_KEY, compute, settings.TRENDING_TAGS_TIMEOUT
+    )
@@ -1,14 +1,19 @@
 import shutil
 import tempfile
+from io import BytesIO
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
 
+from core.storage import ContentAddressedStorage
 from posts.forms import PostForm
-from posts.models import Post, Group, Comment
+from posts.images import delete_unused_image
+from posts.models import Post, Group, Comment, ImageRef
 
 User = get_user_model()
 
@@ -16,6 +21,14 @@ User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
+def jpeg_upload(width, height, name='big.jpg', exif=None):
+    buffer = BytesIO()
+    image = Image.new('RGB', (width, height), 'red')
+    options = {'exif': exif} if exif is not None else {}
+    image.save(buffer, 'JPEG', **options)
+    return SimpleUploadedFile(name, buffer.getvalue(), 'image/jpeg')
+
+
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostCreateFormTests(TestCase):
     @classmethod
@@ -213,3 +226,95 @@ class PostCreateFormTests(TestCase):
             follow=True
         )
         self.assertEqual(Comment.objects.count(), comments_count)
+
+    @override_settings(IMAGE_MAX_SIDE=100)
+    def test_large_image_downscaled(self):
+        """Большая картинка хранится уменьшенной копией."""
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Большая картинка', 'image': jpeg_upload(400, 200)},
+        )
+        post = Post.objects.order_by('id').last()
+        self.assertRegex(post.image.name, r'^posts/\w\w/\w{64}\.jpg$')
+        with Image.open(f'{TEMP_MEDIA_ROOT}/{post.image.name}') as image:
+            self.assertEqual(image.size, (100, 50))
+            self.assertEqual(image.format, 'JPEG')
+
+    def test_rotated_image_normalized(self):
+        """Поворот из EXIF применяется к самой картинке."""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Снимок боком',
+                'image': jpeg_upload(40, 20, 'side.jpg', exif),
+            },
+        )
+        post = Post.objects.order_by('id').last()
+        with Image.open(f'{TEMP_MEDIA_ROOT}/{post.image.name}') as image:
+            self.assertEqual(image.size, (20, 40))
+            self.assertNotIn(0x0112, image.getexif())
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_too_many_pixels_rejected(self):
+        """Картинку больше IMAGE_MAX_PIXELS форма не принимает."""
+        posts_count = Post.objects.count()
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Бомба', 'image': jpeg_upload(100, 100)},
+        )
+        self.assertEqual(Post.objects.count(), posts_count)
+        self.assertFormError(
+            response, 'form', 'image',
+            'Картинка слишком большая: 100×100 пикселей.'
+        )
+
+    def test_same_image_stored_once(self):
+        """Одна и та же картинка в двух постах - один файл."""
+        for text in ('Первый', 'Второй'):
+            self.authorized_client.post(
+                reverse('posts:post_create'),
+                data={'text': text, 'image': SimpleUploadedFile(
+                    f'{text}.gif', self.small_gif, 'image/gif'
+                )},
+            )
+        first, second = Post.objects.order_by('-id')[:2]
+        self.assertEqual(first.image.name, second.image.name)
+        name = first.image.name
+        self.assertEqual(ImageRef.objects.get(name=name).refs, 2)
+        first.delete()
+        self.assertTrue(second.image.storage.exists(name))
+        second.delete()
+        self.assertFalse(second.image.storage.exists(name))
+        self.assertFalse(ImageRef.objects.filter(name=name).exists())
+
+    @override_settings(TASKS_EAGER=False)
+    def test_reupload_survives_pending_delete(self):
+        """Файл, загруженный заново, не удаляет отложенная задача."""
+        def upload(text):
+            self.authorized_client.post(
+                reverse('posts:post_create'),
+                data={'text': text, 'image': SimpleUploadedFile(
+                    f'{text}.gif', self.small_gif, 'image/gif'
+                )},
+            )
+            return Post.objects.order_by('-id')[0]
+
+        name = upload('Первый').image.name
+        Post.objects.get(image=name).delete()
+        self.assertEqual(ImageRef.objects.get(name=name).refs, 0)
+        storage = ContentAddressedStorage
+        exists = storage.exists
+
+        def exists_then_delete(self, path):
+            # Задача удаления выполняется сразу после проверки файла.
+            found = exists(self, path)
+            delete_unused_image(path)
+            return found
+
+        with mock.patch.object(storage, 'exists', exists_then_delete):
+            second = upload('Второй')
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(ImageRef.objects.get(name=name).refs, 1)
+        self.assertTrue(second.image.storage.exists(name))
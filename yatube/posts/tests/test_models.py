@@ -1,7 +1,11 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
 
-from ..models import Group, Post
+from ..models import Comment, Follow, Group, ImageRef, Post, UserCounter
+from ..text import EXCERPT_LENGTH
 
 User = get_user_model()
 
@@ -48,3 +52,135 @@ class PostModelTest(TestCase):
             with self.subTest(adress=field):
                 help_text = task._meta.get_field(f'{field}').help_text
                 self.assertEqual(help_text, text)
+
+
+class CounterTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.author = User.objects.create_user(username='leo')
+
+    def counters(self, user):
+        return UserCounter.objects.get(user=user)
+
+    def test_counters_follow_writes(self):
+        """Счётчики меняются вместе с постами, подписками и комментариями."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Post.objects.create(author=self.author, text='Ещё пост')
+        Follow.objects.create(user=self.user, author=self.author)
+        Comment.objects.create(post=post, author=self.user, text='!')
+        self.assertEqual(self.counters(self.author).posts_count, 2)
+        self.assertEqual(self.counters(self.author).followers_count, 1)
+        self.assertEqual(self.counters(self.user).following_count, 1)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        post.delete()
+        Follow.objects.all().delete()
+        self.assertEqual(self.counters(self.author).posts_count, 1)
+        self.assertEqual(self.counters(self.author).followers_count, 0)
+        self.assertEqual(self.counters(self.user).following_count, 0)
+
+    def test_delete_user_with_posts_and_follows(self):
+        """Удаление пользователя не ломает счётчики остальных."""
+        author = User.objects.create_user(username='leaving')
+        reader = User.objects.create_user(username='reader')
+        post = Post.objects.create(author=author, text='Пост')
+        Comment.objects.create(post=post, author=self.user, text='!')
+        Comment.objects.create(post=post, author=author, text='?')
+        Follow.objects.create(user=self.user, author=author)
+        Follow.objects.create(user=author, author=self.user)
+        Follow.objects.create(user=reader, author=author)
+        author_id = author.pk
+        author.delete()
+        self.assertFalse(
+            UserCounter.objects.filter(user_id=author_id).exists()
+        )
+        self.assertEqual(self.counters(self.user).followers_count, 0)
+        self.assertEqual(self.counters(self.user).following_count, 0)
+        self.assertEqual(self.counters(reader).following_count, 0)
+
+    def test_recount_repairs_drift(self):
+        image = 'posts/ab/' + 'ab' * 32 + '.gif'
+        post = Post.objects.create(
+            author=self.author, text='Пост', image=image
+        )
+        ImageRef.objects.filter(name=image).update(refs=3)
+        Comment.objects.create(post=post, author=self.user, text='!')
+        UserCounter.objects.filter(user=self.author).update(posts_count=7)
+        Post.objects.filter(pk=post.pk).update(comments_count=5)
+        call_command('recount', stdout=StringIO())
+        self.assertEqual(self.counters(self.author).posts_count, 1)
+        self.assertEqual(self.counters(self.user).posts_count, 0)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(ImageRef.objects.get(name=image).refs, 1)
+
+
+class ExcerptTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    def test_short_text_is_its_own_excerpt(self):
+        post = Post.objects.create(author=self.user, text='Коротко')
+        self.assertEqual(post.excerpt, 'Коротко')
+        self.assertFalse(post.excerpt_truncated)
+
+    def test_long_text_cut_on_word(self):
+        post = Post.objects.create(author=self.user, text='слово ' * 100)
+        self.assertLessEqual(len(post.excerpt), EXCERPT_LENGTH)
+        self.assertTrue(post.excerpt.endswith('слово…'))
+        self.assertTrue(post.excerpt_truncated)
+
+    def test_excerpt_follows_text_updates(self):
+        post = Post.objects.create(author=self.user, text='Было')
+        post.text = 'Стало'
+        post.save(update_fields=['text'])
+        post.refresh_from_db()
+        self.assertEqual(post.excerpt, 'Стало')
+
+
+class RenderedTextTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    def test_post_html(self):
+        post = Post.objects.create(
+            author=self.user,
+            text='<script>x</script> см. https://example.com/a?b=1&c=2.\n'
+                 '#котики',
+        )
+        self.assertEqual(
+            post.text_html,
+            '&lt;script&gt;x&lt;/script&gt; см. '
+            '<a href="https://example.com/a?b=1&amp;c=2" '
+            'rel="nofollow noopener">https://example.com/a?b=1&amp;c=2</a>.'
+            '<br>\n<a href="/tag/'
+            '%D0%BA%D0%BE%D1%82%D0%B8%D0%BA%D0%B8/">#котики</a>'
+        )
+        self.assertEqual(post.excerpt_html, post.text_html)
+
+    def test_html_follows_edits(self):
+        post = Post.objects.create(author=self.user, text='Было')
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='a\nb'
+        )
+        self.assertEqual(comment.text_html, 'a<br>\nb')
+        post.text = 'Стало #новое'
+        post.save(update_fields=['text'])
+        post.refresh_from_db()
+        self.assertIn('>#новое</a>', post.text_html)
+        self.assertIn('>#новое</a>', post.excerpt_html)
+
+
+class IndexAuditTest(TestCase):
+    def test_feed_queries_use_indexes(self):
+        """Запросы лент не сканируют таблицы и не сортируют во временном
+        B-дереве."""
+        out = StringIO()
+        call_command('audit_indexes', '--strict', stdout=out)
+        self.assertIn('Проблем найдено: 0', out.getvalue())
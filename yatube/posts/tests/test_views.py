@@ -1,19 +1,41 @@
+import datetime
 import tempfile
 import shutil
+from io import StringIO
 
 from django import forms
 from django.contrib.auth import get_user_model
 from django.test import Client, TestCase, override_settings
 from django.urls.base import reverse
+from django.utils.http import http_date
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
 from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 
-from posts.models import Group, Post, Comment, Follow
+from posts.feeds import comment_page
+from posts.models import Group, Post, Comment, Follow, TagBucket, Timeline
+from posts.search import filter_matching
+from posts.tags import trending_tags
+from posts.management.commands.warm_thumbnails import CHECKPOINT_KEY
+from posts.thumbnails import POST_THUMBNAILS, render_thumbnails
+from sorl.thumbnail import default as thumbnail_default
+from posts.tests.utils import ConstantQueriesMixin, IndexedQueriesMixin
+from utils.utils import encode_cursor
 
 User = get_user_model()
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
 
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
@@ -320,3 +342,818 @@ class TestFollowing(TestCase):
         self.assertEqual(page_obj[0].author, author)
         self.assertIn(new_post_my_follow, page_obj)
         self.assertNotIn(new_post_not_my_follow, page_obj)
+
+    def test_timeline_follows_subscriptions(self):
+        """Лента заполняется при подписке и очищается при отписке."""
+        self.new_subscription()
+        self.assertEqual(
+            Timeline.objects.filter(user=TestFollowing.user).count(),
+            Post.objects.filter(author=TestFollowing.author).count()
+        )
+        new_post = Post.objects.create(author=TestFollowing.author, text='1')
+        self.assertTrue(Timeline.objects.filter(
+            user=TestFollowing.user, post=new_post
+        ).exists())
+        self.authorized_client.get(
+            reverse(
+                'posts:profile_unfollow',
+                kwargs={'username': TestFollowing.author}
+            )
+        )
+        self.assertFalse(
+            Timeline.objects.filter(user=TestFollowing.user).exists()
+        )
+
+
+class TestCursorPagination(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ignatdan')
+        for number in range(25):
+            Post.objects.create(author=cls.user, text=f'Пост {number}')
+
+    def setUp(self):
+        cache.clear()
+
+    def collect(self, query=''):
+        response = self.client.get(reverse('posts:index') + query)
+        return response.context['page_obj']
+
+    def test_walk_feed_with_cursors(self):
+        """Курсоры проходят ленту целиком без пропусков и повторов."""
+        page_obj = self.collect()
+        seen = list(page_obj)
+        while page_obj.has_next():
+            page_obj = self.collect(f'?after={page_obj.next_cursor}')
+            seen.extend(page_obj)
+        self.assertEqual(
+            [post.id for post in seen],
+            list(Post.objects.order_by('-pub_date', '-id').values_list(
+                'id', flat=True
+            ))
+        )
+        self.assertEqual(len(page_obj), 5)
+        previous = self.collect(f'?before={page_obj.previous_cursor}')
+        self.assertEqual(list(previous), seen[10:20])
+
+    def test_cursor_page_has_no_count(self):
+        """Страница по курсору не выполняет COUNT(*)."""
+        page_obj = self.collect()
+        with CaptureQueriesContext(connection) as queries:
+            self.collect(f'?after={page_obj.next_cursor}')
+        self.assertFalse(
+            any('COUNT(' in query['sql'] for query in queries)
+        )
+
+    def test_feed_reads_excerpt_not_text(self):
+        """Лента не читает полный текст постов, а выводит анонс."""
+        Post.objects.create(author=self.user, text='Длинный ' * 100)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:index'))
+        self.assertFalse(any(
+            '"posts_post"."text"' in query['sql'] for query in queries
+        ))
+        self.assertContains(response, 'читать дальше')
+        self.assertNotContains(response, 'Длинный ' * 60)
+
+    def test_broken_cursor_shows_first_page(self):
+        page_obj = self.collect('?after=broken')
+        self.assertFalse(page_obj.has_previous())
+        self.assertEqual(page_obj[0], Post.objects.order_by('id').last())
+
+
+@override_settings(COUNT_COMMENTS_IN_PAGE=10)
+class TestCommentPages(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ignatdan')
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+        for number in range(25):
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text=f'Комментарий {number}'
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_detail_renders_first_batch(self):
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        )
+        self.assertEqual(
+            [comment.text for comment in response.context['comments']],
+            [f'Комментарий {number}' for number in range(10)]
+        )
+        self.assertContains(response, 'Показать ещё')
+
+    def test_load_more_walks_all_comments(self):
+        """Пачки по курсору идут по порядку без пропусков и повторов."""
+        url = reverse('posts:post_comments',
+                      kwargs={'post_id': self.post.id})
+        seen, after = [], ''
+        while after is not None:
+            data = self.client.get(
+                url, {'after': after, 'format': 'json'}
+            ).json()
+            seen.extend(comment['text'] for comment in data['comments'])
+            after = data['next']
+        self.assertEqual(
+            seen, [f'Комментарий {number}' for number in range(25)]
+        )
+        _, after = comment_page(self.post.id, limit=20)
+        response = self.client.get(url, {'after': after})
+        self.assertContains(response, 'Комментарий 24')
+        self.assertNotContains(response, 'Показать ещё')
+
+    def test_missing_post(self):
+        response = self.client.get(
+            reverse('posts:post_comments', kwargs={'post_id': 0})
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class TestTags(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ignatdan')
+
+    def setUp(self):
+        cache.clear()
+
+    def tag_page(self, name, query=''):
+        return self.client.get(
+            reverse('posts:tag_posts', kwargs={'name': name}) + query
+        )
+
+    def test_tag_feed_follows_post_text(self):
+        """Лента тега идёт по дате и следует за правкой текста."""
+        first = Post.objects.create(author=self.user, text='#Котики раз')
+        second = Post.objects.create(author=self.user, text='два #котики')
+        Post.objects.create(author=self.user, text='без тегов')
+        page_obj = self.tag_page('котики').context['page_obj']
+        self.assertEqual(list(page_obj), [second, first])
+        self.assertEqual(self.tag_page('КОТИКИ').status_code, 200)
+        second.text = 'два #собачки'
+        second.save()
+        page_obj = self.tag_page('котики').context['page_obj']
+        self.assertEqual(list(page_obj), [first])
+        first.delete()
+        self.assertEqual(len(self.tag_page('котики').context['page_obj']), 0)
+        self.assertEqual(self.tag_page('нет').status_code, 404)
+
+    def test_tag_feed_cursor_pagination(self):
+        for number in range(15):
+            Post.objects.create(author=self.user, text=f'#лес {number}')
+        page_obj = self.tag_page('лес').context['page_obj']
+        self.assertEqual(len(page_obj), 10)
+        page_obj = self.tag_page(
+            'лес', f'?after={page_obj.next_cursor}'
+        ).context['page_obj']
+        self.assertEqual(
+            [post.text for post in page_obj],
+            [f'#лес {number}' for number in range(4, -1, -1)]
+        )
+
+    def test_trending_from_hour_buckets(self):
+        for text in ('#море #лес', '#море', '#горы'):
+            Post.objects.create(author=self.user, text=text)
+        old = Post.objects.create(author=self.user, text='#старое')
+        Post.objects.filter(pk=old.pk).update(
+            pub_date=old.pub_date - datetime.timedelta(days=3)
+        )
+        TagBucket.objects.filter(tag__name='старое').update(
+            hour=old.pub_date - datetime.timedelta(days=3)
+        )
+        Post.objects.filter(text='#горы').get().delete()
+        self.assertEqual(trending_tags(), [('море', 2), ('лес', 1)])
+        # Показ популярных только читает счётчики.
+        self.assertTrue(
+            TagBucket.objects.filter(tag__name='старое').exists()
+        )
+        call_command('prune_tag_buckets', stdout=StringIO())
+        self.assertFalse(
+            TagBucket.objects.filter(tag__name='старое').exists()
+        )
+        self.assertEqual(TagBucket.objects.filter(count__gt=0).count(), 2)
+
+
+class TestSearch(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ignatdan')
+        cls.best = Post.objects.create(
+            author=cls.user, text='Ёжик ёжик ёжик в тумане'
+        )
+        for number in range(12):
+            Post.objects.create(
+                author=cls.user,
+                text=f'Пост {number} про ежика и длинную прогулку по лесу',
+            )
+        Post.objects.create(author=cls.user, text='Про котов')
+
+    def search(self, query):
+        response = self.client.get(reverse('posts:search') + query)
+        return response.context['page_obj']
+
+    def test_ranked_results_with_cursor(self):
+        """Лучшее совпадение первым, курсор проходит все результаты."""
+        page_obj = self.search('?q=ежик')
+        self.assertEqual(page_obj[0], TestSearch.best)
+        seen = list(page_obj)
+        while page_obj.has_next():
+            page_obj = self.search(
+                f'?q=ежик&after={page_obj.next_cursor}'
+            )
+            seen.extend(page_obj)
+        self.assertEqual(len(seen), 13)
+        self.assertEqual(len(set(seen)), 13)
+
+    def test_query_syntax_is_escaped(self):
+        """Операторы FTS5 в запросе - просто слова."""
+        self.assertEqual(len(self.search('?q=котов" ^(')), 1)
+        self.assertIsNone(self.search('?q=*'))
+
+    def test_index_follows_writes(self):
+        post = Post.objects.create(author=TestSearch.user, text='Жираф')
+        self.assertEqual(list(self.search('?q=жираф')), [post])
+        post.text = 'Слон'
+        post.save()
+        self.assertEqual(list(self.search('?q=жираф')), [])
+        self.assertEqual(list(self.search('?q=слон')), [post])
+        post.delete()
+        self.assertEqual(list(self.search('?q=слон')), [])
+
+    def test_filter_matching_keeps_every_match(self):
+        """Поиск в админке отдаёт все совпадения, а не первое."""
+        self.assertEqual(
+            filter_matching(Post.objects.all(), 'ёжик').count(), 13
+        )
+        self.assertFalse(filter_matching(Post.objects.all(), '*').exists())
+
+    def test_broken_cursor_starts_from_first_page(self):
+        self.assertEqual(self.search('?q=ежик&after=%%%')[0], TestSearch.best)
+
+    def test_rebuild_search_index(self):
+        Post.objects.filter(text='Про котов').update(text='Про собак')
+        self.assertEqual(len(self.search('?q=собак')), 0)
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn(f'Проиндексировано постов: {Post.objects.count()}',
+                      out.getvalue())
+        self.assertEqual(len(self.search('?q=собак')), 1)
+
+
+class TestPostAdmin(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+        groups = [
+            Group.objects.create(title=f'Группа {number}',
+                                 slug=f'group-{number}')
+            for number in range(3)
+        ]
+        for number in range(30):
+            Post.objects.create(
+                author=cls.admin, text=f'Пост {number}',
+                group=groups[number % 3]
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(TestPostAdmin.admin)
+
+    def changelist(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('admin:posts_post_changelist'), params
+            )
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries]
+
+    def test_changelist_without_full_count(self):
+        """Без фильтров строки не считаются, группы берутся из кэша."""
+        response, queries = self.changelist()
+        self.assertEqual(response.context['cl'].result_count, 30)
+        self.assertFalse([sql for sql in queries if 'COUNT(' in sql])
+        self.assertFalse([sql for sql in queries if 'DISTINCT' in sql])
+        group_queries = [sql for sql in queries
+                         if 'FROM "posts_group"' in sql]
+        self.assertEqual(len(group_queries), 1)
+        _, queries = self.changelist()
+        self.assertFalse([sql for sql in queries
+                          if 'FROM "posts_group"' in sql])
+
+    def test_filtered_changelist_counts_exactly(self):
+        response, _ = self.changelist(q='Пост 1')
+        self.assertEqual(response.context['cl'].result_count, 11)
+        Group.objects.create(title='Новая', slug='new')
+        response, _ = self.changelist()
+        self.assertContains(response, 'Новая')
+
+
+@override_settings(FEED_PULL_THRESHOLD=1, FEED_PUSH_THRESHOLD=0)
+class TestHybridFeed(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ignatdan')
+        cls.star = User.objects.create_user(username='star')
+        cls.author = User.objects.create_user(username='leo')
+        fan = User.objects.create_user(username='fan')
+        for follower in (cls.user, fan):
+            Follow.objects.create(user=follower, author=cls.star)
+        Follow.objects.create(user=cls.user, author=cls.author)
+        for number in range(8):
+            Post.objects.create(author=cls.star, text=f'star {number}')
+            Post.objects.create(author=cls.author, text=f'leo {number}')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(TestHybridFeed.user)
+
+    def test_popular_author_is_pulled(self):
+        """Посты популярного автора не раскладываются, но видны в ленте."""
+        self.assertFalse(
+            Timeline.objects.filter(post__author=TestHybridFeed.star).exists()
+        )
+        url = reverse('posts:follow_index')
+        page_obj = self.authorized_client.get(url).context['page_obj']
+        seen = list(page_obj)
+        page_obj = self.authorized_client.get(
+            f'{url}?after={page_obj.next_cursor}'
+        ).context['page_obj']
+        seen.extend(page_obj)
+        self.assertEqual(
+            [post.id for post in seen],
+            list(Post.objects.order_by('-pub_date', '-id').values_list(
+                'id', flat=True
+            ))
+        )
+
+    @override_settings(FEED_PULL_THRESHOLD=2, FEED_PUSH_THRESHOLD=1)
+    def test_mode_switch_has_hysteresis(self):
+        """У порога автор не переключается на каждой отписке."""
+        star = User.objects.create_user(username='nova')
+        fans = [
+            User.objects.create_user(username=f'nova_fan_{number}')
+            for number in range(3)
+        ]
+        Post.objects.create(author=star, text='nova')
+        for fan in fans:
+            Follow.objects.create(user=fan, author=star)
+        Follow.objects.filter(user=fans[0], author=star).delete()
+        # Подписчиков ровно FEED_PULL_THRESHOLD: автор ещё читается,
+        # третьему подписчику ленту не дозаполняли.
+        self.assertEqual(
+            list(Timeline.objects.filter(post__author=star).values_list(
+                'user_id', flat=True
+            )),
+            [fans[1].pk]
+        )
+        Follow.objects.create(user=fans[0], author=star)
+        Follow.objects.filter(user=fans[0], author=star).delete()
+        Follow.objects.filter(user=fans[1], author=star).delete()
+        self.assertEqual(
+            list(Timeline.objects.filter(post__author=star).values_list(
+                'user_id', flat=True
+            )),
+            [fans[2].pk]
+        )
+        Post.objects.create(author=star, text='снова раскладывается')
+        self.assertEqual(
+            Timeline.objects.filter(user=fans[2]).count(), 2
+        )
+
+    def test_feed_pull_authors_command(self):
+        out = StringIO()
+        call_command('feed_pull_authors', stdout=out)
+        self.assertIn('star\t2', out.getvalue())
+        self.assertNotIn('leo', out.getvalue())
+
+
+class TestFeedVersionCache(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ignatdan')
+        for number in range(15):
+            Post.objects.create(author=cls.user, text=f'Пост номер {number}')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages_are_cached_separately(self):
+        """Вторая страница не отдаёт закэшированную первую."""
+        url = reverse('posts:index')
+        first = self.client.get(url)
+        second = self.client.get(
+            f'{url}?after={first.context["page_obj"].next_cursor}'
+        )
+        self.assertIn('Пост номер 14', first.content.decode())
+        self.assertNotIn('Пост номер 14', second.content.decode())
+        self.assertIn('Пост номер 4', second.content.decode())
+
+    def test_new_post_invalidates_index(self):
+        url = reverse('posts:index')
+        self.client.get(url)
+        Post.objects.create(author=TestFeedVersionCache.user, text='Свежий')
+        self.assertIn('Свежий', self.client.get(url).content.decode())
+
+
+class TestConditionalGet(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ignatdan')
+        cls.author = User.objects.create_user(username='leo')
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='test_slug', description='-'
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Первый пост'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(TestConditionalGet.user)
+        self.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'test_slug'}),
+            reverse('posts:profile', kwargs={'username': 'leo'}),
+            reverse(
+                'posts:post_detail',
+                kwargs={'post_id': TestConditionalGet.post.id}
+            ),
+        )
+
+    def revalidate(self, url):
+        response = self.authorized_client.get(url)
+        return self.authorized_client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+
+    def test_unchanged_page_is_not_rendered(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.revalidate(url)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+                self.assertIn('private', response['Cache-Control'])
+
+    def test_changes_make_pages_stale(self):
+        index, group, profile, detail = self.urls
+        changes = (
+            ((index, group, profile, detail), lambda: Post.objects.create(
+                author=TestConditionalGet.author,
+                group=TestConditionalGet.group, text='Второй пост'
+            )),
+            ((detail,), lambda: Comment.objects.create(
+                post=TestConditionalGet.post,
+                author=TestConditionalGet.user, text='!'
+            )),
+            ((profile,), lambda: Follow.objects.create(
+                user=TestConditionalGet.user, author=TestConditionalGet.author
+            )),
+        )
+        for urls, change in changes:
+            etags = [self.authorized_client.get(url)['ETag'] for url in urls]
+            change()
+            for url, etag in zip(urls, etags):
+                with self.subTest(url=url):
+                    response = self.authorized_client.get(
+                        url, HTTP_IF_NONE_MATCH=etag
+                    )
+                    self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since_does_not_hide_edits(self):
+        """Правка поста не даёт 304 по одному If-Modified-Since."""
+        since = http_date()
+        post = TestConditionalGet.post
+        post.text = 'Исправленный пост'
+        post.save()
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=since
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('Last-Modified', response)
+
+    def test_etag_depends_on_user(self):
+        url = reverse('posts:index')
+        etag = self.authorized_client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(HOLE_PUNCHED_PAGES=True)
+class TestHolePunchedPages(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ignatdan')
+        cls.author = User.objects.create_user(username='leo')
+        cls.other = User.objects.create_user(username='tolstoy')
+        cls.post = Post.objects.create(
+            author=cls.author, text='<!--hole auth_nav {}-->'
+        )
+        Follow.objects.create(user=cls.user, author=cls.other)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(TestHolePunchedPages.user)
+        self.author_client = Client()
+        self.author_client.force_login(TestHolePunchedPages.author)
+
+    def test_shared_page_is_personalized(self):
+        url = reverse('posts:profile', kwargs={'username': 'leo'})
+        self.client.get(url)
+        response = self.authorized_client.get(url)
+        self.assertTemplateNotUsed(response, 'posts/profile.html')
+        content = response.content.decode()
+        self.assertIn('Пользователь: ignatdan', content)
+        self.assertNotIn('Войти', content)
+        # Подписка на другого автора не делает кнопку «Отписаться».
+        self.assertIn('Подписаться', content)
+        self.assertNotIn('Отписаться', content)
+        self.assertIn(
+            reverse('posts:post_detail', kwargs={
+                'post_id': TestHolePunchedPages.post.id
+            }),
+            content
+        )
+        own = self.author_client.get(url).content.decode()
+        self.assertIn(
+            reverse('posts:post_edit', kwargs={
+                'post_id': TestHolePunchedPages.post.id
+            }),
+            own
+        )
+
+    def test_extra_params_share_the_cached_page(self):
+        """Посторонние параметры адреса не создают новые копии страницы."""
+        url = reverse('posts:profile', kwargs={'username': 'leo'})
+        self.client.get(url, {'utm': 'a'})
+        for params in ({'utm': 'b'}, {'x': '1'}, {}):
+            with self.subTest(params=params):
+                response = self.client.get(url, params)
+                self.assertTemplateNotUsed(response, 'posts/profile.html')
+        response = self.client.get(url, {'page': '2'})
+        self.assertTemplateUsed(response, 'posts/profile.html')
+
+    def test_comment_form_has_csrf_token(self):
+        url = reverse(
+            'posts:post_detail',
+            kwargs={'post_id': TestHolePunchedPages.post.id}
+        )
+        self.client.get(url)
+        content = self.authorized_client.get(url).content.decode()
+        self.assertIn('csrfmiddlewaretoken', content)
+        self.assertIn('редактировать запись', self.author_client.get(
+            url
+        ).content.decode())
+
+    def test_post_text_cannot_open_a_hole(self):
+        url = reverse(
+            'posts:post_detail',
+            kwargs={'post_id': TestHolePunchedPages.post.id}
+        )
+        content = self.client.get(url).content.decode()
+        self.assertIn('&lt;!--hole auth_nav {}--&gt;', content)
+        self.assertEqual(content.count('Войти'), 1)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class TestThumbnailQueue(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ignatdan')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(TestThumbnailQueue.user)
+
+    def tearDown(self):
+        # Картинки хранятся по хэшу: файлы миниатюр прошлого теста
+        # достались бы следующему, а записи о них откатились с базой.
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def upload(self, name):
+        return SimpleUploadedFile(
+            name=name,
+            content=SMALL_GIF,
+            content_type='image/gif'
+        )
+
+    def thumbnail_ready(self, post):
+        geometry, options = POST_THUMBNAILS[0]
+        _, thumbnail = thumbnail_default.backend.thumbnail_file(
+            post.image, geometry, options
+        )
+        return thumbnail_default.kvstore.get(thumbnail) is not None
+
+    def test_thumbnails_rendered_on_upload(self):
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'С картинкой', 'image': self.upload('new.gif')},
+        )
+        self.assertTrue(self.thumbnail_ready(Post.objects.get()))
+
+    @override_settings(TASKS_EAGER=False)
+    def test_placeholder_until_thumbnail_is_ready(self):
+        post = Post.objects.create(
+            author=TestThumbnailQueue.user, text='Пост',
+            image=self.upload('queued.gif')
+        )
+        url = reverse('posts:index')
+        content = self.client.get(url).content.decode()
+        self.assertIn('data:image/svg+xml', content)
+        self.assertFalse(self.thumbnail_ready(post))
+        render_thumbnails(post.image.name)
+        content = self.client.get(url).content.decode()
+        self.assertNotIn('data:image/svg+xml', content)
+        self.assertTrue(self.thumbnail_ready(post))
+
+    def test_page_thumbnails_are_looked_up_at_once(self):
+        for number in range(5):
+            post = Post.objects.create(
+                author=TestThumbnailQueue.user, text=f'Пост {number}',
+                image=self.upload(f'batch{number}.gif')
+            )
+            render_thumbnails(post.image.name)
+        cache.clear()
+        for lookups in (1, 0):
+            with CaptureQueriesContext(connection) as queries:
+                content = self.client.get(
+                    reverse('posts:profile', kwargs={'username': 'ignatdan'})
+                ).content.decode()
+            self.assertEqual(
+                len([query for query in queries.captured_queries
+                     if 'thumbnail_kvstore' in query['sql']]),
+                lookups
+            )
+            self.assertEqual(content.count('<img class="card-img'), 5)
+            self.assertNotIn('data:image/svg+xml', content)
+            self.assertEqual(content.count('type="image/webp"'), 5)
+            self.assertIn('.webp 480w', content)
+            self.assertIn('.jpg 960w', content)
+
+    @override_settings(TASKS_EAGER=False)
+    def test_missing_thumbnails_are_not_looked_up_again(self):
+        """Недостающие миниатюры ищутся одним запросом и запоминаются."""
+        for number in range(5):
+            Post.objects.create(
+                author=TestThumbnailQueue.user, text=f'Пост {number}',
+                image=self.upload(f'missing{number}.gif')
+            )
+        cache.clear()
+        url = reverse('posts:profile', kwargs={'username': 'ignatdan'})
+        for lookups in (1, 0):
+            with CaptureQueriesContext(connection) as queries:
+                content = self.client.get(url).content.decode()
+            self.assertEqual(
+                len([query for query in queries.captured_queries
+                     if 'thumbnail_kvstore' in query['sql']]),
+                lookups
+            )
+            self.assertEqual(content.count('data:image/svg+xml'), 5)
+
+    def warm(self, **options):
+        out = StringIO()
+        with self.assertLogs('sorl.thumbnail', 'ERROR'):
+            call_command('warm_thumbnails', workers=1, stdout=out, **options)
+        return out.getvalue()
+
+    def test_warm_thumbnails_command(self):
+        first = Post.objects.create(
+            author=TestThumbnailQueue.user, text='Пост',
+            image=self.upload('warm.gif')
+        )
+        Post.objects.create(
+            author=TestThumbnailQueue.user, text='Без файла',
+            image='posts/missing.gif'
+        )
+        self.assertIn('нарисовано миниатюр 6, уже были 0, ошибок 6',
+                      self.warm())
+        self.assertTrue(self.thumbnail_ready(first))
+        self.assertIn('нарисовано миниатюр 0, уже были 6, ошибок 6',
+                      self.warm())
+        cache.set(CHECKPOINT_KEY.format('', ''), first.pk)
+        output = self.warm()
+        self.assertIn(f'Продолжаем после поста {first.pk}', output)
+        self.assertIn('уже были 0, ошибок 6', output)
+
+
+class TestQueryCount(ConstantQueriesMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ignatdan')
+        cls.author = User.objects.create_user(username='leo')
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='test_slug', description='-'
+        )
+        Follow.objects.create(user=cls.user, author=cls.author)
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Первый пост'
+        )
+        Comment.objects.create(post=cls.post, author=cls.user, text='!')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(TestQueryCount.user)
+
+    def add_rows(self):
+        """Добавляет строки с новыми авторами и группами."""
+        for number in range(9):
+            author = User.objects.create_user(username=f'author{number}')
+            group = Group.objects.create(
+                title=f'Группа {number}', slug=f'slug_{number}',
+                description='-'
+            )
+            Follow.objects.create(user=TestQueryCount.user, author=author)
+            Post.objects.create(author=author, group=group, text='Пост')
+            Post.objects.create(
+                author=TestQueryCount.author, group=TestQueryCount.group,
+                text='Ещё пост'
+            )
+            Comment.objects.create(
+                post=TestQueryCount.post, author=author, text='?'
+            )
+
+    def test_feeds_have_constant_query_count(self):
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'test_slug'}),
+            reverse('posts:profile', kwargs={'username': 'leo'}),
+            reverse('posts:follow_index'),
+            reverse(
+                'posts:post_detail', kwargs={'post_id': TestQueryCount.post.id}
+            ),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                with transaction.atomic():
+                    self.assertConstantQueries(
+                        self.authorized_client, url, self.add_rows
+                    )
+                    transaction.set_rollback(True)
+
+
+@override_settings(FEED_PULL_THRESHOLD=0, FEED_PUSH_THRESHOLD=0)
+class TestQueryPlans(IndexedQueriesMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ignatdan')
+        cls.author = User.objects.create_user(username='leo')
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='test_slug', description='-'
+        )
+        # Автор с лентой при чтении: лента подписок сливает источники.
+        Follow.objects.create(user=cls.user, author=cls.author)
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Пост про #планы'
+        )
+        Comment.objects.create(post=cls.post, author=cls.user, text='!')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(TestQueryPlans.user)
+
+    def test_views_do_not_scan_tables(self):
+        """Запросы, которые выполняют представления, идут по индексам."""
+        cursor = encode_cursor(TestQueryPlans.post)
+        post_id = TestQueryPlans.post.id
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:index') + f'?after={cursor}',
+            reverse('posts:index') + f'?before={cursor}',
+            reverse('posts:group_list', kwargs={'slug': 'test_slug'}),
+            reverse('posts:profile', kwargs={'username': 'leo'}),
+            reverse('posts:tag_posts', kwargs={'name': 'планы'}),
+            reverse('posts:follow_index') + f'?after={cursor}',
+            reverse('posts:post_detail', kwargs={'post_id': post_id}),
+            reverse('posts:post_comments', kwargs={'post_id': post_id})
+            + f'?after={cursor}',
+            reverse('posts:search') + '?q=планы',
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertQueriesUseIndexes(self.authorized_client, url)
@@ -0,0 +1,45 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+def count_queries(client, url):
+    """Число запросов к базе при открытии url с пустым кэшем."""
+    cache.clear()
+    with CaptureQueriesContext(connection) as queries:
+        client.get(url)
+    return len(queries)
+
+
+class ConstantQueriesMixin:
+    """Проверка страниц на N+1: число запросов не зависит от числа строк."""
+
+    def assertConstantQueries(self, client, url, add_rows):
+        before = count_queries(client, url)
+        add_rows()
+        self.assertEqual(
+            count_queries(client, url), before,
+            f'Число запросов на {url} растёт вместе с числом строк'
+        )
+
+
+class IndexedQueriesMixin:
+    """Проверка страниц на полные сканирования по планам их запросов."""
+
+    def assertQueriesUseIndexes(self, client, url):
+        from posts.management.commands.audit_indexes import (flagged_lines,
+                                                             query_plan,
+                                                             sort_expected)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            client.get(url)
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            flagged = flagged_lines(
+                query_plan((sql, [])), sort_expected(sql)
+            )
+            self.assertFalse(
+                flagged, f'{url}: запрос без индекса\n{sql}\n{flagged}'
+            )
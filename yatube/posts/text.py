@@ -0,0 +1,71 @@
+import re
+
+from django.urls import reverse
+from django.utils.html import escape, format_html
+
+# Столько символов текста поста выводят ленты; целиком текст
+# показывает только страница поста.
+EXCERPT_LENGTH = 300
+ELLIPSIS = '…'
+
+
+def make_excerpt(text, length=EXCERPT_LENGTH):
+    """Начало text не длиннее length символов, обрезанное по слову."""
+    if len(text) <= length:
+        return text
+    head = text[:length - len(ELLIPSIS)]
+    words = head.rsplit(None, 1)
+    if len(words) == 2 and not text[len(head)].isspace():
+        # Последнее слово обрезано посередине: убираем его целиком.
+        head = words[0]
+    return head.rstrip() + ELLIPSIS
+
+
+# Ссылки и хэштеги в тексте. URL идёт первым: # внутри адреса -
+# часть ссылки, а не хэштег.
+TOKEN = re.compile(
+    r'(?P<url>https?://[^\s<>"\']+)|(?<!\w)#(?P<tag>\w{1,50})'
+)
+TAG_LENGTH = 50
+# Знаки в конце адреса, которые скорее относятся к предложению.
+URL_TRAILING = '.,:;!?)…'
+
+
+def hashtag_url(tag):
+    return reverse('posts:tag_posts', kwargs={'name': tag.lower()})
+
+
+def extract_hashtags(text):
+    """Имена хэштегов текста в нижнем регистре, без повторов."""
+    return {
+        match.group('tag').lower()[:TAG_LENGTH]
+        for match in TOKEN.finditer(text) if match.group('tag')
+    }
+
+
+def render_text(text):
+    """Текст пользователя в безопасный HTML для вывода в шаблоне.
+
+    Весь текст экранируется; ссылками становятся только адреса
+    http(s) и хэштеги, переводы строк - <br>. Результат хранится в
+    модели и пересчитывается при сохранении текста.
+    """
+    text = text.replace('\r\n', '\n')
+    parts = []
+    position = 0
+    for match in TOKEN.finditer(text):
+        parts.append(escape(text[position:match.start()]))
+        if match.group('url'):
+            url = match.group('url').rstrip(URL_TRAILING)
+            parts.append(format_html(
+                '<a href="{0}" rel="nofollow noopener">{0}</a>', url
+            ))
+            parts.append(escape(match.group('url')[len(url):]))
+        else:
+            tag = match.group('tag')
+            parts.append(format_html(
+                '<a href="{}">#{}</a>', hashtag_url(tag), tag
+            ))
+        position = match.end()
+    parts.append(escape(text[position:]))
+    return ''.join(parts).replace('\n', '<br>\n')
@@ -0,0 +1,295 @@
+from functools import partial
+from urllib.parse import quote
+
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import tokey
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+from sorl.thumbnail.parsers import parse_geometry
+
+from core.tasks import enqueue
+from .feeds import bump_feed_version, post_feed_scopes
+from .models import Post
+
+# Ширины миниатюры поста: по srcset браузер берёт ту, что нужна
+# экрану. Высота держит прежнюю пропорцию 960x339.
+POST_IMAGE_WIDTHS = (480, 720, 960)
+POST_IMAGE_RATIO = 339 / 960
+# WebP для браузеров, которые его понимают, JPEG для остальных.
+POST_IMAGE_FORMATS = ('WEBP', 'JPEG')
+FALLBACK_FORMAT = 'JPEG'
+# Миниатюры, которые выводят шаблоны постов (геометрия и параметры
+# sorl): они готовятся сразу после загрузки картинки.
+POST_THUMBNAILS = tuple(
+    (
+        f'{width}x{round(width * POST_IMAGE_RATIO)}',
+        {'crop': 'center', 'upscale': True, 'format': image_format},
+    )
+    for image_format in POST_IMAGE_FORMATS
+    for width in POST_IMAGE_WIDTHS
+)
+# Миниатюра уже стоит в очереди: повторно не ставим, пока ключ жив.
+PENDING_KEY = 'thumbnail_pending:{}'
+# Вместо миниатюр картинки выводилась заглушка: когда они будут
+# готовы, ленты с этим постом нужно сбросить.
+PLACEHOLDER_KEY = 'thumbnail_placeholder:{}'
+PENDING_TIMEOUT = 60 * 10
+
+
+class Placeholder:
+    """Заглушка вместо ещё не готовой миниатюры: серый прямоугольник.
+
+    Картинка встроена в url, поэтому не нужны ни файл, ни запрос.
+    """
+    is_placeholder = True
+
+    def __init__(self, geometry_string):
+        width, height = parse_geometry(geometry_string)
+        self.width, self.height = width or height, height or width
+        svg = (
+            '<svg xmlns="http://www.w3.org/2000/svg" '
+            f'width="{self.width}" height="{self.height}">'
+            '<rect width="100%" height="100%" fill="#dee2e6"/></svg>'
+        )
+        self.url = 'data:image/svg+xml,' + quote(svg)
+
+
+class ResponsiveImage:
+    """Все варианты миниатюры картинки для <picture> и srcset.
+
+    url - самая широкая готовая миниатюра в JPEG для браузеров без
+    srcset; пока её нет - заглушка. В srcset попадают только готовые
+    варианты.
+    """
+
+    def __init__(self, variants):
+        self.srcsets = {image_format: [] for image_format in
+                        POST_IMAGE_FORMATS}
+        fallback = None
+        for (geometry_string, options), image in variants:
+            placeholder = getattr(image, 'is_placeholder', False)
+            if options['format'] == FALLBACK_FORMAT and (
+                fallback is None or not placeholder
+            ):
+                fallback = image
+            if placeholder:
+                continue
+            width, _ = parse_geometry(geometry_string)
+            self.srcsets[options['format']].append(f'{image.url} {width}w')
+        self.url = fallback.url
+
+    @property
+    def srcset(self):
+        return ', '.join(self.srcsets[FALLBACK_FORMAT])
+
+    @property
+    def webp_srcset(self):
+        return ', '.join(self.srcsets.get('WEBP', ()))
+
+
+class QueuedThumbnailBackend(ThumbnailBackend):
+    """Не рисует миниатюры во время запроса.
+
+    Готовая миниатюра берётся из хранилища ключей sorl. Если её ещё
+    нет, шаблон получает заглушку того же размера, а миниатюра
+    ставится в фоновую очередь.
+    """
+
+    def thumbnail_file(self, file_, geometry_string, options):
+        """Исходник и файл миниатюры с тем же именем, что даёт sorl."""
+        source = ImageFile(file_)
+        options = dict(options)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return source, ImageFile(name, default.storage)
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        if not file_:
+            raise ValueError('falsey file_ argument in get_thumbnail()')
+        source, thumbnail = self.thumbnail_file(
+            file_, geometry_string, options
+        )
+        cached = default.kvstore.get(thumbnail)
+        if cached:
+            return cached
+        return self.queue_missing(
+            source.name, [(thumbnail, (geometry_string, options))]
+        )[0]
+
+    def queue_missing(self, name, missing):
+        """Ставит в очередь миниатюры картинки name, которых нет.
+
+        missing - пары (ImageFile миниатюры, (геометрия, параметры)).
+        Возвращает для каждой заглушку или миниатюру, если она успела
+        появиться (при TASKS_EAGER задача выполняется сразу).
+        """
+        queued = [
+            variant for thumbnail, variant in missing
+            if cache.add(PENDING_KEY.format(thumbnail.key), True,
+                         PENDING_TIMEOUT)
+        ]
+        ready = {}
+        if queued:
+            queue_thumbnails(name, queued)
+            ready = kvstore_get_many(
+                thumbnail for thumbnail, _ in missing
+            )
+        if len(ready) < len(missing):
+            cache.set(PLACEHOLDER_KEY.format(tokey(name)), True,
+                      PENDING_TIMEOUT)
+        return [
+            ready.get(thumbnail.key) or Placeholder(geometry_string)
+            for thumbnail, (geometry_string, _) in missing
+        ]
+
+    def render_thumbnail(self, file_, geometry_string, **options):
+        """Рисует миниатюру сразу, как штатный бэкенд sorl."""
+        return super().get_thumbnail(file_, geometry_string, **options)
+
+
+def kvstore_get_many(thumbnails):
+    """Готовые миниатюры из хранилища ключей sorl: {key: ImageFile}.
+
+    Вместо запроса на каждую миниатюру - один get_many к кэшу и один
+    запрос к базе за тем, чего в кэше не оказалось. Ненайденное в
+    базе запоминается в кэше как EMPTY_VALUE, как это делает sorl, и
+    в следующий раз в базу не идёт.
+    """
+    kvstore = default.kvstore
+    if not isinstance(kvstore, cached_db_kvstore.KVStore):
+        found = {thumbnail.key: kvstore.get(thumbnail)
+                 for thumbnail in thumbnails}
+        return {key: image for key, image in found.items() if image}
+    keys = {add_prefix(thumbnail.key): thumbnail.key
+            for thumbnail in thumbnails}
+    values = kvstore.cache.get_many(list(keys))
+    missing = [key for key in keys if key not in values]
+    if missing:
+        loaded = dict(KVStoreModel.objects.filter(
+            key__in=missing
+        ).values_list('key', 'value'))
+        timeout = thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT
+        kvstore.cache.set_many(loaded, timeout)
+        for key in missing:
+            if key not in loaded:
+                # add, а не set: не затираем миниатюру, которую фоновая
+                # задача могла записать после запроса к базе.
+                kvstore.cache.add(
+                    key, cached_db_kvstore.EMPTY_VALUE, timeout
+                )
+        values.update(loaded)
+    return {
+        keys[key]: deserialize_image_file(value)
+        for key, value in values.items()
+        if value and value != cached_db_kvstore.EMPTY_VALUE
+    }
+
+
+def resolve_thumbnails(posts, thumbnails=POST_THUMBNAILS):
+    """Миниатюры постов: {post.pk: [ImageFile или Placeholder, ...]}.
+
+    Список идёт в порядке thumbnails. Недостающие миниатюры сразу
+    ставятся в очередь, без повторного поиска по одной.
+    """
+    backend = default.backend
+    files = {
+        post.pk: [
+            backend.thumbnail_file(post.image, geometry_string, options)[1]
+            for geometry_string, options in thumbnails
+        ]
+        for post in posts
+    }
+    found = kvstore_get_many(
+        thumbnail for variants in files.values() for thumbnail in variants
+    )
+    resolved = {}
+    for post in posts:
+        variants = list(zip(files[post.pk], thumbnails))
+        missing = [
+            (thumbnail, variant) for thumbnail, variant in variants
+            if thumbnail.key not in found
+        ]
+        queued = iter(backend.queue_missing(post.image.name, missing)
+                      if missing else ())
+        resolved[post.pk] = [
+            found[thumbnail.key] if thumbnail.key in found else next(queued)
+            for thumbnail, _ in variants
+        ]
+    return resolved
+
+
+def attach_thumbnails(posts, name='thumbnail'):
+    """Добавляет постам атрибут name с ResponsiveImage картинки.
+
+    Миниатюры всех постов ищутся разом при первом обращении к любой
+    из них: если страница взята из кэша фрагментов, поиска нет вовсе.
+    """
+    posts = [post for post in posts if post.image]
+    resolved = {}
+
+    def lookup(post):
+        if not resolved:
+            resolved.update(resolve_thumbnails(posts))
+        return ResponsiveImage(zip(POST_THUMBNAILS, resolved[post.pk]))
+
+    for post in posts:
+        setattr(post, name, SimpleLazyObject(partial(lookup, post)))
+    return posts
+
+
+def render_thumbnails(name, thumbnails=POST_THUMBNAILS):
+    """Задача очереди: рисует миниатюры картинки name."""
+    for geometry_string, options in thumbnails:
+        default.backend.render_thumbnail(name, geometry_string, **options)
+    placeholder = PLACEHOLDER_KEY.format(tokey(name))
+    if not cache.get(placeholder):
+        return
+    cache.delete(placeholder)
+    posts = Post.objects.filter(image=name).values_list(
+        'pk', 'author_id', 'group_id'
+    )
+    for post_id, author_id, group_id in posts:
+        bump_feed_version(*post_feed_scopes(post_id, author_id, group_id))
+
+
+def warm_image(name, thumbnails=POST_THUMBNAILS):
+    """Готовит миниатюры картинки name, уже готовые не трогает.
+
+    Возвращает (нарисовано, уже были, ошибок). Файл миниатюры, который
+    есть в хранилище, но не записан в хранилище ключей, только
+    записывается туда: картинка при этом не декодируется.
+    """
+    backend = default.backend
+    rendered = existing = failed = 0
+    for geometry_string, options in thumbnails:
+        _, thumbnail = backend.thumbnail_file(name, geometry_string, options)
+        if default.kvstore.get(thumbnail):
+            existing += 1
+            continue
+        exists = thumbnail.exists()
+        backend.render_thumbnail(name, geometry_string, **options)
+        if exists:
+            existing += 1
+        elif default.kvstore.get(thumbnail):
+            rendered += 1
+        else:
+            failed += 1
+    return rendered, existing, failed
+
+
+def queue_thumbnails(name, thumbnails=POST_THUMBNAILS):
+    enqueue(render_thumbnails, name, list(thumbnails))
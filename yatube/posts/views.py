@@ -1,27 +1,57 @@
+from operator import attrgetter
+
 from django.contrib.auth.decorators import login_required
+from django.http import Http404, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 
+from . import conditional
+from .conditional import conditional_page
+from core.holes import hole_punched
 from .forms import PostForm, CommentForm
-from .models import Comment, Group, Post, User, Follow
-from yatube.settings import COUNT_POST_IN_PAGE
-from utils.utils import create_paginator
+from .counters import counters_for
+from .feeds import (TIMELINE_KEYS, cached_feed_page, comment_page,
+                    feed_cache_key, feed_posts, follow_feed, tag_entries)
+from .models import Group, Post, Tag, User, Follow
+from .search import SearchPaginator, decode_rank_cursor, match_expression
+from .tags import trending_tags
+from .thumbnails import attach_thumbnails, queue_thumbnails
+from yatube.settings import COUNT_POST_IN_PAGE, FEED_CACHE_TIMEOUT
+from core.middleware import query_budget
+from utils.utils import create_paginator, decode_cursor
 
 
+@query_budget(queries=8)
+@conditional_page(conditional.index_etag)
+@hole_punched(conditional.index_page_key)
 def index(request):
-    post_list = Post.objects.select_related('group').all()
-    page_obj = create_paginator(request, post_list, COUNT_POST_IN_PAGE)
+    post_list = feed_posts()
+    feed_key = feed_cache_key(request, 'index')
+    page_obj = cached_feed_page(
+        request, feed_key,
+        lambda: create_paginator(request, post_list, COUNT_POST_IN_PAGE)
+    )
+    attach_thumbnails(page_obj)
     index = True
     context = {
         'page_obj': page_obj,
-        'index': index
+        'index': index,
+        'feed_key': feed_key,
+        'feed_cache_timeout': FEED_CACHE_TIMEOUT,
     }
     return render(request, 'posts/index.html', context)
 
 
+@query_budget(queries=8)
+@conditional_page(conditional.group_etag)
+@hole_punched(conditional.group_page_key)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = Post.objects.filter(group=group)
-    page_obj = create_paginator(request, post_list, COUNT_POST_IN_PAGE)
+    post_list = feed_posts(group=group)
+    page_obj = cached_feed_page(
+        request, feed_cache_key(request, f'group:{group.pk}'),
+        lambda: create_paginator(request, post_list, COUNT_POST_IN_PAGE)
+    )
+    attach_thumbnails(page_obj)
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -29,40 +59,120 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@query_budget(queries=8)
+def tag_posts(request, name):
+    tag = get_object_or_404(Tag, name=name.lower())
+    post_tags = tag_entries(tag.pk)
+    page_obj = cached_feed_page(
+        request, feed_cache_key(request, f'tag:{tag.pk}'),
+        lambda: create_paginator(
+            request, post_tags, COUNT_POST_IN_PAGE,
+            keys=TIMELINE_KEYS, transform=attrgetter('post')
+        )
+    )
+    attach_thumbnails(page_obj)
+    context = {
+        'tag': tag,
+        'page_obj': page_obj,
+        'trending_tags': trending_tags(),
+    }
+    return render(request, 'posts/tag_list.html', context)
+
+
+@query_budget(queries=8)
+@conditional_page(conditional.profile_etag)
+@hole_punched(conditional.profile_page_key)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = Post.objects.filter(author=author)
-    page_obj = create_paginator(request, posts, COUNT_POST_IN_PAGE)
-    count = posts.count()
-    following = False
-    if request.user.is_authenticated and Follow.objects.filter(
-        user=request.user
-    ).exists():
-        following = True
+    author = get_object_or_404(
+        User.objects.select_related('counters'), username=username
+    )
+    posts = feed_posts(author=author)
+    page_obj = cached_feed_page(
+        request, feed_cache_key(request, f'author:{author.pk}'),
+        lambda: create_paginator(request, posts, COUNT_POST_IN_PAGE)
+    )
+    attach_thumbnails(page_obj)
+    counters = counters_for(author)
     context = {
         'author': author,
-        'count': count,
+        'count': counters.posts_count,
+        'counters': counters,
         'page_obj': page_obj,
-        'following': following
     }
     return render(request, 'posts/profile.html', context)
 
 
+@query_budget(queries=8)
+@conditional_page(conditional.post_etag)
+@hole_punched(conditional.post_page_key)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    author = post.author
-    count = Post.objects.filter(author=author).count()
+    post = get_object_or_404(
+        Post.objects.select_related('author__counters', 'group'), id=post_id
+    )
+    count = counters_for(post.author).posts_count
+    attach_thumbnails([post])
     form = CommentForm(request.POST or None)
-    comments = Comment.objects.filter(post=post)
+    comments, comments_next = comment_page(post.pk)
     context = {
         'post': post,
         'count': count,
         'form': form,
-        'comments': comments
+        'comments': comments,
+        'comments_next': comments_next,
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+@query_budget(queries=3)
+def post_comments(request, post_id):
+    """Следующая пачка комментариев для кнопки «Показать ещё».
+
+    По умолчанию - кусок HTML, с ?format=json - данные комментариев.
+    """
+    if not Post.objects.filter(pk=post_id).exists():
+        raise Http404
+    comments, comments_next = comment_page(
+        post_id, decode_cursor(request.GET.get('after'))
+    )
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'comments': [
+                {
+                    'id': comment.pk,
+                    'author': comment.author.username,
+                    'text': comment.text,
+                    'html': comment.text_html,
+                    'pub_date': comment.pub_date,
+                }
+                for comment in comments
+            ],
+            'next': comments_next,
+        })
+    context = {
+        'post_id': post_id,
+        'comments': comments,
+        'comments_next': comments_next,
+    }
+    return render(request, 'posts/includes/comment_list.html', context)
+
+
+@query_budget(queries=8)
+def search(request):
+    query = request.GET.get('q', '').strip()
+    match = match_expression(query)
+    page_obj = None
+    if match is not None:
+        page_obj = SearchPaginator(match, COUNT_POST_IN_PAGE).cursor_page(
+            after=decode_rank_cursor(request.GET.get('after'))
+        )
+        attach_thumbnails(page_obj)
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def post_create(request):
     form = PostForm(
@@ -73,6 +183,8 @@ def post_create(request):
         form = form.save(commit=False)
         form.author = request.user
         form.save()
+        if form.image:
+            queue_thumbnails(form.image.name)
         return redirect('posts:profile', form.author)
     context = {
         'form': form,
@@ -92,7 +204,9 @@ def post_edit(request, post_id):
         instance=post
     )
     if form.is_valid():
-        form.save()
+        post = form.save()
+        if post.image and 'image' in form.changed_data:
+            queue_thumbnails(post.image.name)
         return redirect('posts:post_detail', post_id=post_id)
     context = {
         'post': post,
@@ -115,15 +229,19 @@ def add_comment(request, post_id):
 
 
 @login_required
+@query_budget(queries=10)
 def follow_index(request):
-    follows = Follow.objects.filter(user=request.user)
-    authors = User.objects.filter(following__in=follows)
-    posts = Post.objects.filter(author__in=authors)
-    page_obj = create_paginator(request, posts, COUNT_POST_IN_PAGE)
+    feed_key = feed_cache_key(request, 'index', f'follow:{request.user.pk}')
+    page_obj = cached_feed_page(
+        request, feed_key, lambda: follow_feed(request, COUNT_POST_IN_PAGE)
+    )
+    attach_thumbnails(page_obj)
     follow = True
     context = {
         'page_obj': page_obj,
-        'follow': follow
+        'follow': follow,
+        'feed_key': feed_key,
+        'feed_cache_timeout': FEED_CACHE_TIMEOUT,
     }
     return render(request, 'posts/follow.html', context)
 
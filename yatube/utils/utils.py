@@ -1,7 +1,263 @@
-from django.core.paginator import Paginator
+import base64
+import binascii
+import heapq
 
+from django.core.paginator import Page, Paginator
+from django.db import DatabaseError, connection
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_datetime
 
-def create_paginator(request, post_list, count_post_in_page):
-    paginator = Paginator(post_list, count_post_in_page)
-    page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+# Поля, по которым строится курсор: дата публикации и id для
+# однозначного порядка постов с одинаковой датой.
+CURSOR_KEYS = ('pub_date', 'id')
+
+
+def encode_token(*parts):
+    """Непрозрачный токен из частей ключа для параметров запроса."""
+    raw = '|'.join(str(part) for part in parts)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    """Пара строк из токена encode_token или None, если токен битый."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    parts = raw.rsplit('|', 1)
+    return parts if len(parts) == 2 else None
+
+
+def encode_cursor(obj):
+    """Кодирует ключ (pub_date, id) объекта в непрозрачный токен."""
+    return encode_token(obj.pub_date.isoformat(), obj.pk)
+
+
+def decode_cursor(token):
+    """Возвращает (pub_date, id) из токена или None, если токен битый."""
+    parts = decode_token(token)
+    if parts is None:
+        return None
+    try:
+        pub_date, pk = parse_datetime(parts[0]), int(parts[1])
+    except ValueError:
+        return None
+    if pub_date is None:
+        return None
+    return pub_date, pk
+
+
+def feed_key(obj):
+    """Ключ сортировки ленты: новые посты идут первыми."""
+    return obj.pub_date, obj.pk
+
+
+def cursor_queryset(queryset, keys, limit, after=None, before=None):
+    """Срез queryset на limit строк от курсора, ещё не выполненный.
+
+    keys - поля queryset, по которым идёт сравнение с курсором.
+    При before строки идут от курсора к новым постам.
+    Условие по одной дате задаёт границу диапазона по индексу,
+    условие по id лишь разбирает посты с одинаковой датой.
+    """
+    date_key, id_key = keys
+    if before is not None:
+        pub_date, pk = before
+        return queryset.filter(
+            Q(**{f'{date_key}__gte': pub_date}),
+            Q(**{f'{date_key}__gt': pub_date}) | Q(**{f'{id_key}__gt': pk}),
+        ).order_by(date_key, id_key)[:limit]
+    if after is not None:
+        pub_date, pk = after
+        queryset = queryset.filter(
+            Q(**{f'{date_key}__lte': pub_date}),
+            Q(**{f'{date_key}__lt': pub_date}) | Q(**{f'{id_key}__lt': pk}),
+        )
+    return queryset.order_by(f'-{date_key}', f'-{id_key}')[:limit]
+
+
+def cursor_slice(queryset, keys, limit, after=None, before=None):
+    """Возвращает до limit строк от курсора в порядке ленты."""
+    rows = list(cursor_queryset(queryset, keys, limit, after, before))
+    if before is not None:
+        rows.reverse()
+    return rows
+
+
+class CursorPaginator(Paginator):
+    """Пагинатор по ключу (pub_date, id) без COUNT(*) и OFFSET.
+
+    Страница выбирается диапазоном по индексу от курсора, поэтому
+    глубокие страницы стоят столько же, сколько первая. Общее число
+    страниц неизвестно: номер страницы и num_pages условные и нужны
+    только для методов has_next/has_previous у Page.
+
+    transform превращает строку queryset в пост ленты (например,
+    запись Timeline в её Post); курсор всегда строится по посту.
+    """
+
+    def __init__(self, object_list, per_page, keys=CURSOR_KEYS,
+                 transform=None):
+        super().__init__(object_list, per_page)
+        self.keys = keys
+        self.transform = transform
+
+    def _check_object_list_is_ordered(self):
+        # Порядок задаёт сам пагинатор: по keys.
+        pass
+
+    def __getstate__(self):
+        # Готовую страницу можно класть в кэш: queryset при
+        # сериализации выполнился бы целиком, поэтому он не нужен.
+        state = self.__dict__.copy()
+        for name in ('object_list', 'sources'):
+            if name in state:
+                state[name] = None
+        return state
+
+    def _slice(self, after=None, before=None):
+        """Возвращает per_page + 1 постов в порядке ленты."""
+        rows = cursor_slice(
+            self.object_list, self.keys, self.per_page + 1, after, before
+        )
+        if self.transform is not None:
+            rows = [self.transform(row) for row in rows]
+        return rows
+
+    def cursor_page(self, after=None, before=None):
+        items = self._slice(after=after, before=before)
+        has_more = len(items) > self.per_page
+        if before is not None:
+            if not items:
+                # Курсор новее всех постов: показываем начало ленты.
+                return self.cursor_page()
+            items = items[-self.per_page:]
+            has_next, has_previous = True, has_more
+        else:
+            items = items[:self.per_page]
+            has_next, has_previous = has_more, after is not None
+        number = 2 if has_previous else 1
+        self.num_pages = number + 1 if has_next else number
+        page = Page(items, number, self)
+        page.is_cursor = True
+        page.next_cursor = page.previous_cursor = None
+        if items and has_next:
+            page.next_cursor = encode_cursor(items[-1])
+        if items and has_previous:
+            page.previous_cursor = encode_cursor(items[0])
+        return page
+
+
+class MergedCursorPaginator(CursorPaginator):
+    """Курсорная пагинация сразу по нескольким упорядоченным источникам.
+
+    sources - список троек (queryset, keys, transform). С каждого
+    источника берётся не больше per_page + 1 постов от курсора, и они
+    сливаются k-way слиянием по (pub_date, id). Пост, попавший сразу
+    в несколько источников, показывается один раз.
+    """
+
+    def __init__(self, sources, per_page):
+        super().__init__(None, per_page)
+        self.sources = sources
+
+    def _slice(self, after=None, before=None):
+        limit = self.per_page + 1
+        streams = []
+        for queryset, keys, transform in self.sources:
+            rows = cursor_slice(queryset, keys, limit, after, before)
+            if transform is not None:
+                rows = [transform(row) for row in rows]
+            streams.append(rows)
+        items = []
+        for item in heapq.merge(*streams, key=feed_key, reverse=True):
+            if items and feed_key(items[-1]) == feed_key(item):
+                continue
+            items.append(item)
+        if before is not None:
+            return items[-limit:]
+        return items[:limit]
+
+
+def read_cursors(request):
+    """Возвращает (after, before, page) из параметров запроса."""
+    return (
+        decode_cursor(request.GET.get('after')),
+        decode_cursor(request.GET.get('before')),
+        request.GET.get('page'),
+    )
+
+
+def create_paginator(request, post_list, count_post_in_page,
+                     keys=CURSOR_KEYS, transform=None):
+    after, before, page_number = read_cursors(request)
+    if page_number is not None and after is None and before is None:
+        # Старые ссылки вида ?page=N: пагинация со смещением.
+        date_key, id_key = keys
+        paginator = Paginator(
+            post_list.order_by(f'-{date_key}', f'-{id_key}'),
+            count_post_in_page
+        )
+        page_obj = paginator.get_page(page_number)
+        if transform is not None:
+            page_obj.object_list = [
+                transform(row) for row in page_obj.object_list
+            ]
+        return page_obj
+    paginator = CursorPaginator(
+        post_list, count_post_in_page, keys, transform
+    )
+    return paginator.cursor_page(after=after, before=before)
+
+
+def create_merged_paginator(request, sources, fallback, count_post_in_page):
+    """Страница слияния sources; fallback нужен для ссылок ?page=N."""
+    after, before, page_number = read_cursors(request)
+    if page_number is not None and after is None and before is None:
+        return create_paginator(request, fallback, count_post_in_page)
+    paginator = MergedCursorPaginator(sources, count_post_in_page)
+    return paginator.cursor_page(after=after, before=before)
+
+
+def estimated_count(model):
+    """Примерное число строк таблицы model без COUNT(*).
+
+    Берётся из статистики ANALYZE (sqlite_stat1), а если её нет - по
+    наибольшему первичному ключу: удалённые строки дают завышение.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                'SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table]
+            )
+            stats = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+        except DatabaseError:
+            stats = []
+        if stats:
+            return max(stats)
+        pk = connection.ops.quote_name(model._meta.pk.column)
+        cursor.execute(
+            f'SELECT max({pk}) FROM {connection.ops.quote_name(table)}'
+        )
+        return cursor.fetchone()[0] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator, который не считает строки таблицы без фильтров.
+
+    Для такого списка число строк оценивается estimated_count, и
+    последние страницы могут оказаться пустыми. С фильтром или поиском
+    число считается точно: выборка идёт по индексу.
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is None or query.where or query.distinct:
+            return super().count
+        return estimated_count(self.object_list.model)
@@ -38,6 +38,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -132,10 +133,81 @@ EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 # указываем директорию, в которую будут складываться файлы писем
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
+# Общий для всех воркеров кэш в файле SQLite (см. core.cache).
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_SIZE': 256 * 1024 * 1024,
+        },
     }
 }
 
+# Фоновые задачи (core.tasks): число потоков и выполнение сразу,
+# без очереди.
+TASK_WORKERS = 2
+TASKS_EAGER = False
+
+# Миниатюры рисуются фоновыми задачами, до этого выводится заглушка.
+THUMBNAIL_BACKEND = 'posts.thumbnails.QueuedThumbnailBackend'
+
+# Картинки постов (posts.images): больше IMAGE_MAX_PIXELS пикселей
+# не принимаются, сторона больше IMAGE_MAX_SIDE уменьшается при
+# загрузке. Загрузки больше FILE_UPLOAD_MAX_MEMORY_SIZE пишутся во
+# временный файл, а не держатся в памяти.
+IMAGE_MAX_PIXELS = 50 * 1000 * 1000
+IMAGE_MAX_SIDE = 2048
+IMAGE_MASTER_QUALITY = 90
+
+# Загрузки в эти каталоги хранятся под хэшем содержимого: одна и та
+# же картинка в разных постах - один файл и один набор миниатюр.
+DEFAULT_FILE_STORAGE = 'core.storage.ContentAddressedStorage'
+CONTENT_ADDRESSED_UPLOADS = ('posts/',)
+
+# Тесты подменяют кэш и очередь задач (core.testing.TestSettings).
+TEST_RUNNER = 'core.testing.TestRunner'
+
 COUNT_POST_IN_PAGE = 10
+# Комментариев на странице поста и в каждой подгружаемой пачке.
+COUNT_COMMENTS_IN_PAGE = 20
+# Фрагменты лент сбрасываются по версии при записи, поэтому их
+# можно хранить долго.
+FEED_CACHE_TIMEOUT = 60 * 60 * 6
+
+# Популярные хэштеги: за сколько последних часов, сколько штук и
+# на сколько секунд кэшировать список. Счётчики старше окна удаляет
+# команда prune_tag_buckets.
+TRENDING_TAGS_HOURS = 24
+TRENDING_TAGS_COUNT = 10
+TRENDING_TAGS_TIMEOUT = 60 * 5
+
+# Посты авторов, у которых подписчиков стало больше
+# FEED_PULL_THRESHOLD, не раскладываются по лентам при публикации, а
+# подмешиваются при чтении. Обратно автор переводится, только когда
+# подписчиков осталось не больше FEED_PUSH_THRESHOLD: у порога
+# режим не переключается на каждой подписке и отписке.
+FEED_PULL_THRESHOLD = 1000
+FEED_PUSH_THRESHOLD = 900
+
+# Бюджеты запросов к базе по именам маршрутов: число запросов или
+# {'queries': ..., 'time': мс}. Перекрывают декоратор query_budget.
+QUERY_BUDGETS = {}
+# Бросать исключение при превышении бюджета; в тестах включено
+# (core.testing.TestSettings).
+QUERY_BUDGET_RAISE = False
+
+# Устаревшее значение кэша отдаётся ещё столько секунд, пока один
+# запрос пересчитывает его (core.caching.get_or_compute).
+CACHE_STALE_GRACE = 60
+# Сколько держится блокировка пересчёта, если её владелец не снял,
+# и сколько запрос без блокировки ждёт значение, которого в кэше нет.
+CACHE_LOCK_TIMEOUT = 30
+CACHE_LOCK_WAIT = 1
+
+# Кэшировать страницы лент и постов одной копией на всех
+# пользователей; личные куски (меню, кнопки) дорисовываются при
+# каждом запросе (core.holes.hole_punched).
+HOLE_PUNCHED_PAGES = False
+PAGE_CACHE_TIMEOUT = FEED_CACHE_TIMEOUT